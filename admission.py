@@ -0,0 +1,171 @@
+"""Admission control and cancellation for the inference endpoints.
+
+AdmissionControl bounds the number of prediction requests a process accepts
+at once, in total and per client, so bursts are turned away with 429 instead
+of queueing behind the model without limit. Cancellation tells a running
+prediction to stop between windows once its deadline passes or its client
+has disconnected.
+"""
+import math
+import time
+import socket
+import threading
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted.
+
+    :param message: Reason shown to the client
+    :type message: str
+    :param retry_after: Suggested seconds to wait before retrying
+    :type retry_after: int
+    """
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionControl:
+    """Bounded set of in-flight prediction requests with per-client limits.
+
+    :param max_pending: Requests admitted at once, running or waiting for the model
+    :type max_pending: int
+    :param max_per_client: Requests admitted at once for a single client
+    :type max_per_client: int
+    """
+
+    def __init__(self, max_pending: int = 8, max_per_client: int = 2):
+        self.max_pending = max_pending
+        self.max_per_client = max_per_client
+        self._lock = threading.Lock()
+        self._clients = {}  # client -> admitted requests
+        self._pending = 0
+        self._service_seconds = None  # moving average of admitted request durations
+        self.admitted = 0
+        self.rejected = 0
+
+    def admit(self, client: str, concurrency: int = 1) -> 'Admission':
+        """Admits a request or raises AdmissionRejected.
+
+        :param client: Identifier of the requesting client
+        :type client: str
+        :param concurrency: Requests the model runs at once, used for Retry-After
+        :type concurrency: int
+        :return: Admission to release once the request is done
+        :rtype: Admission
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise AdmissionRejected("Server is busy, try again later",
+                                        self._retry_after(self._pending, concurrency))
+            if self._clients.get(client, 0) >= self.max_per_client:
+                self.rejected += 1
+                raise AdmissionRejected(f"At most {self.max_per_client} concurrent predictions per client",
+                                        self._retry_after(self._clients[client], 1))
+            self._pending += 1
+            self._clients[client] = self._clients.get(client, 0) + 1
+            self.admitted += 1
+        return Admission(self, client)
+
+    def _retry_after(self, queued: int, concurrency: int) -> int:
+        # Time for the requests ahead to drain, at least one second
+        if self._service_seconds is None:
+            return 1
+        return max(1, math.ceil(self._service_seconds * queued / max(1, concurrency)))
+
+    def _release(self, client: str, seconds: float):
+        with self._lock:
+            self._pending -= 1
+            self._clients[client] -= 1
+            if not self._clients[client]:
+                del self._clients[client]
+            if self._service_seconds is None:
+                self._service_seconds = seconds
+            else:
+                self._service_seconds = 0.8 * self._service_seconds + 0.2 * seconds
+
+    def stats(self) -> dict:
+        """Returns the current load and counters.
+
+        :return: Admission statistics
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'pending': self._pending,
+                'max_pending': self.max_pending,
+                'max_per_client': self.max_per_client,
+                'clients': len(self._clients),
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'service_seconds': self._service_seconds,
+            }
+
+
+class Admission:
+    """An admitted request; releasing it frees its slot. Releasing twice is harmless."""
+
+    def __init__(self, control: AdmissionControl, client: str):
+        self._control = control
+        self._client = client
+        self._start = time.monotonic()
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._control._release(self._client, time.monotonic() - self._start)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+
+class Cancellation:
+    """Callable polled by the predictor between windows.
+
+    Returns True once the deadline has passed or the client's connection is
+    closed; ``reason`` then says which. Disconnects are detected by peeking at
+    the request socket, which the Werkzeug development server exposes as
+    ``werkzeug.socket`` and gunicorn as ``gunicorn.socket``; without either,
+    only the deadline applies.
+
+    :param timeout: Seconds the request may take, None for no deadline
+    :type timeout: float
+    :param environ: WSGI environ of the request
+    :type environ: dict
+    """
+
+    def __init__(self, timeout: float = None, environ: dict = None):
+        self.deadline = None if timeout is None else time.monotonic() + timeout
+        self.reason = None
+        environ = environ or {}
+        self._socket = environ.get('werkzeug.socket') or environ.get('gunicorn.socket')
+
+    def __call__(self) -> bool:
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            self.reason = 'deadline'
+        elif self._disconnected():
+            self.reason = 'disconnected'
+        return self.reason is not None
+
+    def _disconnected(self) -> bool:
+        if self._socket is None:
+            return False
+        try:
+            # The request body has been read, so an orderly shutdown reads as b''
+            return self._socket.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+        except (BlockingIOError, InterruptedError):
+            return False
+        except ValueError:
+            return False  # TLS sockets do not support peeking
+        except OSError:
+            return True
@@ -1,14 +1,26 @@
-from os import listdir
+from os import listdir, environ, getpid
 from os.path import join, isfile, splitext, basename
 import base64
+import hmac
 import re
+import json
+import time
 import argparse
+import threading
+from functools import wraps
 from typing import Union
 
-from flask import Flask, render_template, jsonify, request, redirect, url_for
-from predictor import Predictor
+from flask import (Flask, Response, render_template, jsonify, request, redirect, url_for, stream_with_context,
+                   g, make_response, send_from_directory)
+from predictor import ReloadingPredictor, PredictionCancelled, MemoryBudgetExceeded
+from admission import AdmissionControl, AdmissionRejected, Cancellation
+from metrics import metrics, BYTES_BUCKETS
+from profiling import profiler
+from pixel_cache import PixelCache
 
-predictor = Predictor(model_settings_path='model_settings.yaml')
+predictor = ReloadingPredictor(model_settings_path='model_settings.yaml')
+if predictor.model_settings.get('hot_reload', False):
+    predictor.start_watching()
 
 parser = argparse.ArgumentParser()
 # Config
@@ -16,7 +28,35 @@ parser.add_argument('--root_data_path', default="./datasets", type=str,
                     help="""Path to the root data folder. Must be the
                             parent folder containing category folders.
                             Defaults to ./datasets""")
-args = parser.parse_args()
+parser.add_argument('--max_batch_images', default=64, type=int,
+                    help="Maximum number of images accepted by /predict/batch")
+parser.add_argument('--max_batch_mb', default=1024, type=int,
+                    help="Maximum decoded size of all images of one /predict/batch request; "
+                         "images beyond it are reported as errors")
+parser.add_argument('--max_pending', default=8, type=int,
+                    help="Prediction requests admitted at once; more are rejected with 429")
+parser.add_argument('--max_per_client', default=2, type=int,
+                    help="Prediction requests admitted at once per client")
+parser.add_argument('--request_timeout', default=60.0, type=float,
+                    help="Seconds a prediction may take before it is cancelled; clients can lower "
+                         "it with the X-Request-Timeout header")
+parser.add_argument('--pixel_cache_dir', default=".pixel_cache", type=str,
+                    help="Directory caching decoded dataset images as memory-mapped .npy files")
+parser.add_argument('--pixel_cache_mb', default=2048, type=int,
+                    help="Size budget of the decoded-image cache, 0 disables it")
+# Tolerate arguments meant for a hosting process (e.g. serve.py) that imports this module
+args, _ = parser.parse_known_args()
+
+admission_control = AdmissionControl(max_pending=args.max_pending, max_per_client=args.max_per_client)
+pixel_cache = PixelCache(args.pixel_cache_dir, args.pixel_cache_mb * 1024 * 1024) if args.pixel_cache_mb else None
+metrics.describe('time_to_first_tile_seconds', "Seconds from a /predict/stream request to its first tile")
+metrics.describe('stream_requests_total', "Requests to /predict/stream")
+metrics.describe('request_estimated_peak_bytes', "Estimated peak memory of a prediction request")
+metrics.describe('request_peak_rss_bytes', "Process RSS peak while a prediction request ran")
+metrics.describe('request_rss_growth_bytes', "Process RSS growth while a prediction request ran")
+metrics.describe('request_peak_tensor_bytes', "CUDA tensor memory peak above the baseline while a prediction request ran")
+metrics.describe('memory_budget_rejections_total', "Prediction requests rejected by request_memory_budget_mb")
+metrics.describe('memory_budget_reroutes_total', "Prediction requests rerouted to sliding windows to fit the memory budget")
 
 
 # Utility Functions
@@ -236,12 +276,243 @@ def save(path:str, data:str, postfix:str='.png') -> bool:
         raise Exception(f"Failed to save file: {e}")
 
 
+def decode_base64_image(image_data: str):
+    """Decodes a base64 image, with or without a data URL prefix, for the predictor.
+
+    :param image_data: Base64 encoded PNG or JPEG
+    :type image_data: str
+    :return: BGR image as a uint8 (H, W, 3) array, or None if it cannot be decoded
+    """
+    import numpy as np
+    import cv2
+
+    # Remove data URL prefix if present (already handled by FileSystem.js, but just in case)
+    if image_data.startswith('data:image'):
+        image_data = image_data.split(',', 1)[1]
+    nparr = np.frombuffer(base64.b64decode(image_data), np.uint8)
+    return cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+
+
+def load_dataset_image(path: str) -> tuple:
+    """Decodes a dataset image, through the decoded-pixel cache when it is enabled.
+
+    :param path: Image file path
+    :type path: str
+    :raises FileNotFoundError: If the image does not exist
+    :return: (BGR uint8 (H, W, 3) array or None if undecodable, version string
+        that changes whenever the file does)
+    :rtype: tuple
+    """
+    if pixel_cache is not None:
+        return pixel_cache.load(path)
+    import hashlib
+    import numpy as np
+    import cv2
+
+    with open(path, 'rb') as file:
+        data = file.read()
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR), hashlib.sha1(data).hexdigest()
+
+
+def load_source_region(source: dict) -> tuple:
+    """Loads a dataset image referenced by a crop prediction request.
+
+    :param source: ``{"dataset", "filename", "x", "y", "width", "height"}``
+    :type source: dict
+    :raises ValueError: If the reference or crop is invalid
+    :raises FileNotFoundError: If the image does not exist
+    :return: (image or None if undecodable, image version, (y, x, height, width))
+    :rtype: tuple
+    """
+    dataset, filename = source['dataset'], source['filename']
+    if basename(dataset) != dataset or basename(filename) != filename:
+        raise ValueError(f"{dataset}/{filename}")
+    image, version = load_dataset_image(join('datasets', dataset, 'images', filename))
+    region = (int(source['y']), int(source['x']), int(source['height']), int(source['width']))
+    if image is not None:
+        y, x, height, width = region
+        if height <= 0 or width <= 0 or y < 0 or x < 0 or y + height > image.shape[0] or x + width > image.shape[1]:
+            raise ValueError(f"crop {region} is outside the {image.shape[0]}x{image.shape[1]} image")
+    # The version keys cached windows, so edits to the file invalidate them
+    return image, version, region
+
+
+def parse_output_params(params) -> tuple:
+    """Reads the optional ``output`` and ``threshold`` prediction parameters.
+
+    :param params: Request JSON body, form or query arguments
+    :return: (output, threshold); output is None when a parameter is invalid
+        and threshold is None when the model settings default applies
+    :rtype: tuple
+    """
+    output = params.get('output', 'mask')
+    threshold = params.get('threshold')
+    try:
+        threshold = None if threshold is None else float(threshold)
+    except (TypeError, ValueError):
+        return None, None
+    if output not in ('mask', 'uint8') or (threshold is not None and not 0 <= threshold <= 1):
+        return None, None
+    return output, threshold
+
+
+def admitted(view):
+    """Decorator applying admission control to a prediction endpoint.
+
+    Rejects the request with 429 and a Retry-After header when too many
+    predictions are in flight, in total or for this client. Admitted requests
+    get ``g.cancel``, a Cancellation to pass to the predictor, and keep their
+    slot until the response (including a streamed one) has been sent.
+    """
+    @wraps(view)
+    def wrapper(*view_args, **view_kwargs):
+        client = request.headers.get('X-Client-Id') or request.remote_addr
+        try:
+            admission = admission_control.admit(client, predictor.runtime['max_concurrent_forwards'])
+        except AdmissionRejected as e:
+            response = jsonify({"status": "error", "message": str(e)})
+            response.status_code = 429
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response
+        timeout = args.request_timeout
+        try:
+            timeout = min(timeout, float(request.headers.get('X-Request-Timeout', timeout)))
+        except ValueError:
+            pass
+        g.cancel = Cancellation(timeout, request.environ)
+        try:
+            response = make_response(view(*view_args, **view_kwargs))
+        except BaseException:
+            admission.release()
+            raise
+        response.call_on_close(admission.release)
+        return response
+    return wrapper
+
+
+def profiled(view):
+    """Decorator running the endpoint under the on-demand profiler when a capture is armed."""
+    @wraps(view)
+    def wrapper(*view_args, **view_kwargs):
+        with profiler.request(view.__name__):
+            return view(*view_args, **view_kwargs)
+    return wrapper
+
+
+def debug_authorized() -> bool:
+    """Checks the request's debug token against MASKER_DEBUG_TOKEN.
+
+    Debug endpoints are disabled when the environment variable is unset. The
+    token is sent as ``Authorization: Bearer <token>`` or ``X-Debug-Token``.
+    """
+    expected = environ.get('MASKER_DEBUG_TOKEN')
+    if not expected:
+        return False
+    token = request.headers.get('X-Debug-Token', '')
+    authorization = request.headers.get('Authorization', '')
+    if authorization.startswith('Bearer '):
+        token = authorization[len('Bearer '):]
+    return hmac.compare_digest(token.encode(), expected.encode())
+
+
+def record_memory(info: dict):
+    """Records the memory figures the predictor put in a request's info dict."""
+    if 'memory_rerouted_from' in info:
+        metrics.increment('memory_budget_reroutes_total')
+    for key in ('estimated_peak_bytes', 'peak_rss_bytes', 'rss_growth_bytes', 'peak_tensor_bytes'):
+        if key in info:
+            metrics.observe(f"request_{key}", info[key], buckets=BYTES_BUCKETS)
+
+
+def cancelled_response(cancel: Cancellation):
+    """Builds the error response for a prediction stopped by its Cancellation."""
+    if cancel.reason == 'deadline':
+        return jsonify({"status": "error", "message": "Prediction deadline exceeded"}), 503
+    # The client is gone; nobody reads this
+    return jsonify({"status": "error", "message": "Client disconnected"}), 499
+
+
+@app.route('/metrics', methods=['GET'])
+def service_metrics():
+    """Exposes service metrics in the Prometheus text format."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/version', methods=['GET'])
+def model_version() -> str:
+    """Reports the active model version and the last reload failure, if any."""
+    return jsonify(predictor.version_info())
+
+
+@app.route('/runtime', methods=['GET'])
+def runtime() -> str:
+    """Reports the effective inference runtime configuration."""
+    return jsonify(dict(predictor.runtime_info(), admission=admission_control.stats(),
+                        pixel_cache=pixel_cache.stats() if pixel_cache is not None else None))
+
+
+@app.route('/debug/profile', methods=['GET', 'POST', 'DELETE'])
+def debug_profile():
+    """Arms the profiler (POST), disarms it (DELETE) or reports its status and captures (GET).
+
+    POST takes ``requests`` (profile the next N /predict requests) and/or
+    ``seconds`` (stop after T seconds), whichever ends first, and optionally
+    ``interval_ms`` for the Python stack sampler. Captures end after
+    ``profiler.max_seconds`` at the latest. Each capture holds a Chrome trace
+    and operator table per profiled request and the folded stacks of all
+    threads; download them from ``/debug/profile/<capture>/<filename>``.
+
+    Arming applies to the process that answers: with several gunicorn workers
+    only that worker (``pid`` in the response) profiles its own requests.
+    Requires the MASKER_DEBUG_TOKEN token.
+    """
+    if not debug_authorized():
+        return jsonify({"status": "error", "message": "Not found"}), 404
+    if request.method == 'GET':
+        return jsonify(profiler.status())
+    if request.method == 'DELETE':
+        return jsonify({"status": "success", "disarmed": profiler.disarm(), "pid": getpid()})
+    params = request.get_json(silent=True) or request.form
+    try:
+        requests = int(params['requests']) if params.get('requests') is not None else None
+        seconds = float(params['seconds']) if params.get('seconds') is not None else None
+        interval_ms = float(params.get('interval_ms', 5.0))
+        if (requests is not None and requests < 1) or (seconds is not None and seconds <= 0) or interval_ms <= 0:
+            raise ValueError("requests, seconds and interval_ms must be positive")
+        capture = profiler.arm(requests=requests, seconds=seconds, interval_ms=interval_ms)
+    except (TypeError, ValueError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify({"status": "success", "capture": capture,
+                    "message": f"Armed in worker process {capture['pid']} only; other workers are not profiled"})
+
+
+@app.route('/debug/profile/<capture>/<filename>', methods=['GET'])
+def debug_profile_file(capture: str, filename: str):
+    """Downloads one artifact of a profiling capture."""
+    if not debug_authorized():
+        return jsonify({"status": "error", "message": "Not found"}), 404
+    # send_from_directory rejects paths escaping the capture directory
+    return send_from_directory(join(profiler.root, basename(capture)), filename, as_attachment=True)
+
+
 @app.route('/predict', methods=['POST', 'GET'])
+@admitted
+@profiled
 def predict():
     """Endpoint for crack prediction using the model.
     
     This endpoint receives a base64 encoded image either via POST (JSON body) or GET (query parameter),
     runs it through the predictor model, and returns a base64 encoded mask of the prediction.
+    Optional parameters: ``threshold`` (mask probability threshold, defaults to mask_threshold
+    in model_settings.yaml) and ``output`` ('mask', or 'uint8' for the quantized probability map).
+
+    Instead of the image, a JSON body may reference a crop of a dataset image with
+    ``{"source": {"dataset", "filename", "x", "y", "width", "height"}}``. The crop is
+    then predicted with windows on the full image's grid, which are cached, so
+    overlapping crops of the same image reuse each other's work.
+
+    Images whose estimated peak memory exceeds ``request_memory_budget_mb`` are
+    rerouted to sliding windows or, if those do not fit either, rejected with 413.
     
     Returns:
         JSON response with the predicted mask encoded in base64
@@ -258,8 +529,10 @@ def predict():
         else:  # GET
             # Get from query parameter
             image_data = request.args.get('image')
+        params = request.json if request.is_json else (request.form if request.method == 'POST' else request.args)
+        source = params.get('source') if request.is_json else None
             
-        if not image_data:
+        if not image_data and not source:
             return jsonify({
                 "status": "error", 
                 "message": "No image data provided. Use POST with JSON body {'image': 'base64_data'} or GET with '?image=base64_data'"
@@ -267,47 +540,56 @@ def predict():
         
         # Process the base64 image data
         try:
-            # Remove data URL prefix if present (already handled by FileSystem.js, but just in case)
-            if image_data.startswith('data:image'):
-                image_data = image_data.split(',', 1)[1]
-                
-            # Convert base64 to bytes
-            image_bytes = base64.b64decode(image_data)
-            
-            # Convert to numpy array for OpenCV
-            import numpy as np
-            nparr = np.frombuffer(image_bytes, np.uint8)
-            
-            # Decode image
             import cv2
-            image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            if source:
+                try:
+                    image, image_key, region = load_source_region(source)
+                except (KeyError, TypeError, ValueError) as e:
+                    return jsonify({"status": "error", "message": f"Invalid source: {e}"}), 400
+                except FileNotFoundError:
+                    return jsonify({"status": "error", "message": "Source image not found."}), 404
+            else:
+                image = decode_base64_image(image_data)
             if image is None:
                 return jsonify({
                     "status": "error", 
                     "message": "Failed to decode image. Make sure it's a valid image."
                 }), 400
             
-            # Run the prediction
+            # Threshold and output mode may be given per request
+            output, threshold = parse_output_params(params)
+            if output is None:
+                return jsonify({
+                    "status": "error",
+                    "message": "output must be 'mask' or 'uint8' and threshold a number between 0 and 1"
+                }), 400
+
+            # Run the prediction; the mask (or quantized probability map) is computed by the predictor
+            info = {}
             try:
-                prediction_result = predictor(image)
+                if source:
+                    prediction_result = predictor.predict_region(image, region, image_key, info=info, output=output,
+                                                                 threshold=threshold, cancel=g.cancel)
+                else:
+                    prediction_result = predictor(image, info=info, output=output, threshold=threshold,
+                                                  cancel=g.cancel)
+                record_memory(info)
+            except PredictionCancelled:
+                return cancelled_response(g.cancel)
+            except MemoryBudgetExceeded as e:
+                metrics.increment('memory_budget_rejections_total')
+                return jsonify({"status": "error", "message": f"{e}; send a smaller image or crop"}), 413
             except Exception as e:
                 return jsonify({
                     "status": "error", 
                     "message": f"Error during prediction: {str(e)}"
                 }), 500
             
-            # Process the prediction output to get a binary mask
-            # The prediction output format may vary depending on your model
-            # Adjust this part based on your specific model output format
-            if prediction_result.ndim > 2:
-                prediction_result = prediction_result.squeeze()
-            
-            # Convert to binary mask (assuming prediction is probability map)
-            threshold = 0.5
-            binary_mask = (prediction_result > threshold).astype(np.uint8) * 255
+            binary_mask = prediction_result.squeeze() if prediction_result.ndim > 2 else prediction_result
             
             # Encode the binary mask to PNG
             success, encoded_img = cv2.imencode('.png', binary_mask)
+            predictor.release(prediction_result)
             if not success:
                 return jsonify({
                     "status": "error", 
@@ -321,7 +603,8 @@ def predict():
             return jsonify({
                 "status": "success",
                 "message": "Prediction completed successfully",
-                "mask_base64": f"data:image/png;base64,{mask_base64}"
+                "mask_base64": f"data:image/png;base64,{mask_base64}",
+                "info": info
             })
             
         except Exception as e:
@@ -341,5 +624,233 @@ def predict():
         }), 500
 
 
+@app.route('/predict/batch', methods=['POST'])
+@admitted
+def predict_batch():
+    """Endpoint for predicting many images in one request.
+
+    Images are either uploaded as multipart files under the ``images`` field, or
+    referenced by a JSON body ``{"dataset": name, "filenames": [...]}`` naming files
+    in the dataset's images folder. ``threshold`` and ``output`` work as for /predict.
+
+    Windows of all images are pooled into shared model batches. The response is
+    newline-delimited JSON: one line per image in completion order, with its mask
+    and timing, followed by a summary line.
+
+    Returns:
+        Streamed NDJSON response, or a JSON error before any image is processed
+    """
+    import numpy as np
+    import cv2
+
+    start = time.perf_counter()
+    if request.is_json:
+        params = request.json
+        dataset = params.get('dataset')
+        filenames = params.get('filenames') or []
+        if not dataset or not isinstance(filenames, list):
+            return jsonify({
+                "status": "error",
+                "message": "Provide multipart 'images' files or JSON {'dataset': name, 'filenames': [...]}"
+            }), 400
+        sources = []
+        for filename in filenames:
+            if basename(dataset) != dataset or basename(filename) != filename:
+                return jsonify({"status": "error", "message": f"Invalid file reference: {dataset}/{filename}"}), 400
+            sources.append((filename, join('datasets', dataset, 'images', filename)))
+    else:
+        params = request.form
+        sources = [(file.filename, file) for file in request.files.getlist('images')]
+    if not sources:
+        return jsonify({"status": "error", "message": "No images provided."}), 400
+    if len(sources) > args.max_batch_images:
+        return jsonify({
+            "status": "error",
+            "message": f"At most {args.max_batch_images} images per batch, got {len(sources)}"
+        }), 400
+    output, threshold = parse_output_params(params)
+    if output is None:
+        return jsonify({
+            "status": "error",
+            "message": "output must be 'mask' or 'uint8' and threshold a number between 0 and 1"
+        }), 400
+
+    # Decode everything up front so unreadable and oversized images are reported without holding up the rest
+    names, images, failures = [], [], []
+    batch_size = predictor.multi_image_batch_size()
+    decoded_bytes, max_decoded_bytes = 0, args.max_batch_mb * 1024 * 1024
+    for name, source in sources:
+        if isinstance(source, str):
+            image = load_dataset_image(source)[0] if isfile(source) else None
+        else:
+            image = cv2.imdecode(np.frombuffer(source.read(), np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            failures.append((name, "Failed to read image."))
+            continue
+        if decoded_bytes + image.nbytes > max_decoded_bytes:
+            failures.append((name, f"Batch exceeds {args.max_batch_mb} MB of decoded images; send it separately."))
+            continue
+        try:
+            predictor.enforce_memory_budget(image, 'sliding', output, batch_size=batch_size)
+        except MemoryBudgetExceeded as e:
+            metrics.increment('memory_budget_rejections_total')
+            failures.append((name, str(e)))
+            continue
+        decoded_bytes += image.nbytes
+        names.append(name)
+        images.append(image)
+
+    cancel = g.cancel
+
+    def generate():
+        for name, message in failures:
+            yield json.dumps({"name": name, "status": "error", "message": message}) + '\n'
+        infos = [{} for _ in images]
+        succeeded = 0
+        try:
+            for index, prediction_result in predictor.predict_many(images, infos=infos, output=output,
+                                                                   threshold=threshold, cancel=cancel):
+                images[index] = None  # Done with the input; let it be freed
+                record_memory(infos[index])
+                binary_mask = prediction_result.squeeze() if prediction_result.ndim > 2 else prediction_result
+                success, encoded_img = cv2.imencode('.png', binary_mask)
+                predictor.release(prediction_result)
+                if not success:
+                    yield json.dumps({"name": names[index], "status": "error",
+                                      "message": "Failed to encode prediction result"}) + '\n'
+                    continue
+                succeeded += 1
+                mask_base64 = base64.b64encode(encoded_img).decode('utf-8')
+                yield json.dumps({
+                    "name": names[index],
+                    "status": "success",
+                    "mask_base64": f"data:image/png;base64,{mask_base64}",
+                    "info": infos[index],
+                }) + '\n'
+        except PredictionCancelled:
+            yield json.dumps({"status": "error", "message": f"Prediction cancelled: {cancel.reason}"}) + '\n'
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            yield json.dumps({"status": "error", "message": f"Error during prediction: {str(e)}"}) + '\n'
+        yield json.dumps({
+            "status": "done",
+            "images": len(sources),
+            "succeeded": succeeded,
+            "seconds": time.perf_counter() - start,
+        }) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@app.route('/predict/stream', methods=['POST'])
+@admitted
+def predict_stream():
+    """Endpoint for progressive prediction of large images.
+
+    Takes the same JSON body as /predict and answers with server-sent events:
+    a ``tile`` event per finished region of the mask, as soon as all windows
+    covering it are done, with its position in the image, then one ``done``
+    event with the prediction info and the time to the first tile. Errors
+    arrive as an ``error`` event.
+
+    Returns:
+        text/event-stream response, or a JSON error before prediction starts
+    """
+    import queue
+    import cv2
+
+    start = time.perf_counter()
+    metrics.increment('stream_requests_total')
+    params = request.json if request.is_json else request.form
+    image_data = params.get('image')
+    if not image_data:
+        return jsonify({"status": "error", "message": "No image data provided."}), 400
+    output, threshold = parse_output_params(params)
+    if output is None:
+        return jsonify({
+            "status": "error",
+            "message": "output must be 'mask' or 'uint8' and threshold a number between 0 and 1"
+        }), 400
+    try:
+        image = decode_base64_image(image_data)
+    except ValueError:
+        image = None
+    if image is None:
+        return jsonify({"status": "error", "message": "Failed to decode image. Make sure it's a valid image."}), 400
+
+    # The prediction runs on its own thread and hands tiles over; tiles are
+    # encoded here so PNG encoding overlaps with the next windows
+    events = queue.Queue()
+    stopped = threading.Event()
+    request_cancel = g.cancel
+
+    def cancel():
+        return stopped.is_set() or request_cancel()
+
+    def run():
+        info = {}
+        try:
+            prediction_result = predictor(image, info=info, output=output, threshold=threshold, cancel=cancel,
+                                          on_tile=lambda y, x, tile: events.put(('tile', (y, x, tile))))
+            predictor.release(prediction_result)
+            record_memory(info)
+            events.put(('done', info))
+        except PredictionCancelled:
+            events.put(('error', f"Prediction cancelled: {request_cancel.reason or 'stream closed'}"))
+        except MemoryBudgetExceeded as e:
+            metrics.increment('memory_budget_rejections_total')
+            events.put(('error', str(e)))
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            events.put(('error', f"Error during prediction: {str(e)}"))
+
+    def event(name: str, data: dict) -> str:
+        return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+    def generate():
+        first_tile = None
+        try:
+            while True:
+                kind, payload = events.get()
+                if kind == 'tile':
+                    y, x, tile = payload
+                    success, encoded_img = cv2.imencode('.png', tile)
+                    if not success:
+                        continue
+                    if first_tile is None:
+                        first_tile = time.perf_counter() - start
+                        metrics.observe('time_to_first_tile_seconds', first_tile)
+                    yield event('tile', {
+                        "x": x,
+                        "y": y,
+                        "width": tile.shape[1],
+                        "height": tile.shape[0],
+                        "mask_base64": "data:image/png;base64," + base64.b64encode(encoded_img).decode('utf-8'),
+                    })
+                elif kind == 'done':
+                    yield event('done', {
+                        "status": "success",
+                        "info": payload,
+                        "time_to_first_tile": first_tile,
+                        "seconds": time.perf_counter() - start,
+                    })
+                    return
+                else:
+                    yield event('error', {"status": "error", "message": payload})
+                    return
+        finally:
+            # Also reached when the client goes away mid-stream; stop the prediction
+            stopped.set()
+
+    threading.Thread(target=run, daemon=True).start()
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
 if __name__ == "__main__":
+    # Development server; see serve.py for the production entry point
     app.run(host="0.0.0.0", port=8000, debug=True)
@@ -0,0 +1,213 @@
+"""Autotunes sliding-window inference for the configured model on this host.
+
+Sweeps window_size (multiples of 32), batch size, intra-op and inter-op
+threads, measures output pixels/sec and keeps the fastest configuration
+whose peak RSS stays within the RAM budget. The winner is written to the
+per-host tuning cache (``<tuning_cache_dir>/<hostname>.yaml``), which
+Predictor loads automatically at startup.
+
+Usage:
+    python autotune.py --image datasets/test1/images/137.png --ram_budget_mb 4096
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+import numpy as np
+
+from memory import PeakRSSSampler, read_rss_bytes
+
+
+def parse_int_list(text: str) -> list[int]:
+    """Parses a comma separated list of integers.
+
+    :param text: Text such as "1,2,4"
+    :type text: str
+    :return: The parsed integers
+    :rtype: list[int]
+    """
+    return [int(value) for value in text.split(',') if value.strip()]
+
+
+def load_image(args) -> np.ndarray:
+    """Loads the benchmark image, or a seeded random one when no path is given.
+
+    :return: Image as a uint8 (H, W, 3) array
+    :rtype: np.ndarray
+    """
+    if args.image:
+        import cv2
+        image = cv2.imread(args.image, cv2.IMREAD_COLOR)
+        if image is None:
+            raise RuntimeError(f"Failed to read image: {args.image}")
+        return image
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, size=(args.size, args.size, 3), dtype=np.uint8)
+
+
+def measure(args) -> list[dict]:
+    """Measures every window/batch combination with this process's thread counts.
+
+    Runs in a child process because inter-op threads can only be set once
+    per process. Combinations are tried from smallest to largest working set;
+    once one exceeds the budget, by estimate, measured RSS or a failed
+    allocation, larger ones are not attempted.
+
+    :return: One result dict per combination
+    :rtype: list[dict]
+    """
+    from predictor import Predictor
+
+    predictor = Predictor(args.settings, settings_overrides={
+        'use_tuning_cache': False,
+        'inference_mode': 'sliding',
+        'request_memory_budget_mb': None,  # --ram_budget_mb is enforced on measured RSS instead
+        'intra_op_threads': args.intra_op_threads,
+        'inter_op_threads': args.inter_op_threads,
+    })
+    image = load_image(args)
+    output_pixels = image.shape[0] * image.shape[1]
+    budget = args.ram_budget_mb * 1024 * 1024
+
+    combos = sorted(((w, b) for w in args.window_sizes for b in args.batch_sizes),
+                    key=lambda combo: combo[0] ** 2 * combo[1])
+    results = []
+    over_budget_at = None
+    for window_size, batch_size in combos:
+        result = {
+            'window_size': window_size,
+            'batch_size': batch_size,
+            'intra_op_threads': args.intra_op_threads,
+            'inter_op_threads': args.inter_op_threads,
+        }
+        if over_budget_at is not None and window_size ** 2 * batch_size >= over_budget_at:
+            result['skipped'] = 'ram_budget'
+            results.append(result)
+            continue
+
+        predictor.predictor.window_size = window_size
+        predictor.predictor.batch_size = batch_size
+        # Skip combinations whose estimate alone cannot fit next to what the process already holds
+        estimate = predictor.estimate_memory(image.shape[0], image.shape[1], 'sliding')['bytes']
+        if (read_rss_bytes() or 0) + estimate > budget:
+            over_budget_at = window_size ** 2 * batch_size
+            result['skipped'] = 'ram_budget'
+            result['estimated_mb'] = round(estimate / (1024 * 1024), 1)
+            results.append(result)
+            continue
+        try:
+            # Warm-up run also builds the tiling plan and measures peak memory
+            with PeakRSSSampler() as sampler:
+                predictor(image)
+        except ValueError as e:
+            result['skipped'] = str(e)
+            results.append(result)
+            continue
+        except RuntimeError as e:
+            # Allocation failures surface as RuntimeError; treat them like exceeding the budget
+            over_budget_at = window_size ** 2 * batch_size
+            result['skipped'] = 'ram_budget'
+            result['error'] = str(e)
+            results.append(result)
+            continue
+
+        # RSS cannot be read on every platform; without it only the speed is measured
+        if sampler.peak is not None:
+            result['peak_rss_mb'] = round(sampler.peak / (1024 * 1024), 1)
+            if sampler.peak > budget:
+                over_budget_at = window_size ** 2 * batch_size
+                result['skipped'] = 'ram_budget'
+                results.append(result)
+                continue
+
+        start = time.perf_counter()
+        for _ in range(args.repeats):
+            predictor(image)
+        elapsed = time.perf_counter() - start
+        result['pixels_per_sec'] = round(output_pixels * args.repeats / elapsed, 1)
+        results.append(result)
+        print(f"  {result}", file=sys.stderr)
+    return results
+
+
+def main():
+    cores = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--settings', default='model_settings.yaml', type=str,
+                        help="Path to the model settings YAML file")
+    parser.add_argument('--image', default=None, type=str,
+                        help="Benchmark image; a random --size x --size image when omitted")
+    parser.add_argument('--size', default=2048, type=int,
+                        help="Side length of the random benchmark image")
+    parser.add_argument('--ram_budget_mb', default=4096, type=int,
+                        help="Peak RSS allowed for a configuration, in MB")
+    parser.add_argument('--window_sizes', default='256,320,384,448,512,640,768', type=parse_int_list,
+                        help="Comma separated window sizes (multiples of 32)")
+    parser.add_argument('--batch_sizes', default='1,2,4', type=parse_int_list,
+                        help="Comma separated batch sizes")
+    parser.add_argument('--intra_op_threads_list', type=parse_int_list,
+                        default=sorted({cores, max(1, cores // 2), max(1, cores // 4)}, reverse=True),
+                        help="Comma separated intra-op thread counts (default derived from core count)")
+    parser.add_argument('--inter_op_threads_list', default='1,2', type=parse_int_list,
+                        help="Comma separated inter-op thread counts")
+    parser.add_argument('--repeats', default=3, type=int,
+                        help="Timed runs per configuration")
+    parser.add_argument('--dry_run', action='store_true',
+                        help="Report the winner without writing the tuning cache")
+    # Internal: measure a single thread configuration in a child process
+    parser.add_argument('--measure', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--intra_op_threads', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--inter_op_threads', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    invalid = [w for w in args.window_sizes if w % 32]
+    if invalid:
+        parser.error(f"window sizes must be multiples of 32: {invalid}")
+
+    if args.measure:
+        print(json.dumps(measure(args)))
+        return
+
+    results = []
+    for intra in args.intra_op_threads_list:
+        for inter in args.inter_op_threads_list:
+            print(f"Measuring intra_op_threads={intra}, inter_op_threads={inter}")
+            command = [sys.executable, os.path.abspath(__file__), '--measure',
+                       '--intra_op_threads', str(intra), '--inter_op_threads', str(inter),
+                       '--settings', args.settings, '--size', str(args.size),
+                       '--ram_budget_mb', str(args.ram_budget_mb),
+                       '--window_sizes', ','.join(map(str, args.window_sizes)),
+                       '--batch_sizes', ','.join(map(str, args.batch_sizes)),
+                       '--repeats', str(args.repeats)]
+            if args.image:
+                command += ['--image', args.image]
+            child = subprocess.run(command, stdout=subprocess.PIPE, text=True)
+            if child.returncode != 0:
+                print(f"  measurement failed with exit code {child.returncode}")
+                continue
+            # The child prints its results as JSON on the last stdout line
+            results.extend(json.loads(child.stdout.strip().splitlines()[-1]))
+
+    candidates = [r for r in results if 'pixels_per_sec' in r]
+    if not candidates:
+        print("No configuration fits the RAM budget.")
+        sys.exit(1)
+    best = max(candidates, key=lambda r: r['pixels_per_sec'])
+    best['tuned_at'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+    print(f"Best configuration: {best}")
+
+    if not args.dry_run:
+        import yaml
+        from predictor import save_tuning_result, tuning_cache_path
+        with open(args.settings, 'r') as file:
+            settings = yaml.safe_load(file)
+        path = tuning_cache_path(settings)
+        save_tuning_result(path, settings['model_type'], best)
+        print(f"Saved to {path}")
+
+
+if __name__ == "__main__":
+    main()
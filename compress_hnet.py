@@ -0,0 +1,146 @@
+"""Compresses HNet's 1024-channel layers with low-rank factorization.
+
+The KxK convolutions in the fine and coarse bottlenecks and the PANet fusion
+block are replaced by a truncated SVD: a KxK convolution into ``rank``
+channels followed by a 1x1 convolution back to 1024 (see model/low_rank.py).
+The rank is either fixed (--rank) or chosen per layer to keep a fraction of
+the singular value energy (--energy).
+
+The compressed checkpoint is loaded by Predictor like any other; it detects
+the factorized layers from their ``.reduce.weight`` keys. Point ``pth_path``
+in model_settings.yaml at it.
+
+The tool reports the speedup of a single window forward and of full
+predictions, and the IoU of the compressed model's masks against the
+original model's masks on a folder of images.
+
+Usage:
+    python compress_hnet.py --energy 0.9 --images datasets/test1/images --output hnet_lowrank.pth
+"""
+import os
+import copy
+import time
+import argparse
+
+import cv2
+import numpy as np
+import torch
+
+from model.low_rank import compress_model
+
+TARGETS = ('fine_bottleneck', 'coarse_bottleneck', 'fusion_bottleneck')
+
+
+def time_forward(model, batch: torch.Tensor, repeats: int) -> float:
+    """Returns the mean seconds of one forward pass after a warm-up pass.
+
+    :param model: Model to time
+    :param batch: Input batch
+    :type batch: torch.Tensor
+    :param repeats: Timed passes
+    :type repeats: int
+    :return: Mean seconds per pass
+    :rtype: float
+    """
+    with torch.no_grad():
+        model(batch)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            model(batch)
+    return (time.perf_counter() - start) / repeats
+
+
+def mask_iou(reference: np.ndarray, candidate: np.ndarray) -> float:
+    """Returns the IoU of two binary masks, 1.0 when both are empty.
+
+    :param reference: Reference mask
+    :type reference: np.ndarray
+    :param candidate: Mask to compare
+    :type candidate: np.ndarray
+    :return: Intersection over union
+    :rtype: float
+    """
+    union = np.logical_or(reference, candidate).sum()
+    if union == 0:
+        return 1.0
+    return float(np.logical_and(reference, candidate).sum() / union)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--settings', default='model_settings.yaml', type=str,
+                        help="Path to the model settings YAML file (model_type must be hnet)")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--rank', type=int, help="Fixed rank for every factorized layer")
+    group.add_argument('--energy', type=float, help="Fraction of singular value energy to keep, e.g. 0.9")
+    parser.add_argument('--min_channels', default=1024, type=int,
+                        help="Only factorize convolutions with at least this many input and output channels")
+    parser.add_argument('--images', default=None, type=str,
+                        help="Folder of images to measure speedup and mask IoU on")
+    parser.add_argument('--max_images', default=20, type=int,
+                        help="Images from the folder to evaluate")
+    parser.add_argument('--repeats', default=5, type=int,
+                        help="Timed passes for the window benchmark")
+    parser.add_argument('--output', default=None, type=str,
+                        help="Where to save the compressed checkpoint")
+    args = parser.parse_args()
+
+    from predictor import Predictor
+
+    predictor = Predictor(args.settings, settings_overrides={'use_tuning_cache': False, 'hot_reload': False})
+    if predictor.model_settings['model_type'].lower() != 'hnet':
+        raise SystemExit("compress_hnet.py only supports model_type: hnet")
+    threshold = predictor.model_settings.get('mask_threshold', 0.5)
+
+    original = predictor.model
+    compressed = copy.deepcopy(original)
+    report = compress_model(compressed, TARGETS, rank=args.rank, energy=args.energy, min_channels=args.min_channels)
+    compressed.eval()
+    params_before = sum(entry.get('params', 0) for entry in report)
+    params_after = sum(entry.get('compressed_params', 0) for entry in report)
+    for entry in report:
+        print(f"  {entry}")
+    print(f"Factorized {sum('rank' in entry for entry in report)} layers: "
+          f"{params_before / 1e6:.1f}M -> {params_after / 1e6:.1f}M parameters")
+
+    window_size = predictor.predictor.window_size
+    batch = torch.rand((predictor.predictor.batch_size, 3, window_size, window_size), device=predictor.device)
+    if predictor.model_settings.get('memory_format', 'contiguous') == 'channels_last':
+        batch = batch.contiguous(memory_format=torch.channels_last)
+    original_seconds = time_forward(original, batch, args.repeats)
+    compressed_seconds = time_forward(compressed, batch, args.repeats)
+    print(f"Window forward: {original_seconds * 1000:.1f} ms -> {compressed_seconds * 1000:.1f} ms "
+          f"({original_seconds / compressed_seconds:.2f}x)")
+
+    if args.images:
+        paths = sorted(os.path.join(args.images, name) for name in os.listdir(args.images)
+                       if name.lower().endswith(('.png', '.jpg', '.jpeg')))[:args.max_images]
+        ious, original_total, compressed_total = [], 0.0, 0.0
+        for path in paths:
+            image = cv2.imread(path, cv2.IMREAD_COLOR)
+            if image is None:
+                continue
+            predictor.model = original
+            start = time.perf_counter()
+            reference = predictor(image, output='mask', threshold=threshold)
+            original_total += time.perf_counter() - start
+            predictor.model = compressed
+            start = time.perf_counter()
+            candidate = predictor(image, output='mask', threshold=threshold)
+            compressed_total += time.perf_counter() - start
+            ious.append(mask_iou(reference > 0, candidate > 0))
+            print(f"  {os.path.basename(path)}: IoU {ious[-1]:.4f}")
+        predictor.model = original
+        if ious:
+            print(f"{len(ious)} images: mean IoU {np.mean(ious):.4f}, min IoU {np.min(ious):.4f}, "
+                  f"prediction speedup {original_total / compressed_total:.2f}x")
+
+    if args.output:
+        # Zip-format save keeps the checkpoint memory-mappable (see load_checkpoint)
+        state_dict = {name: tensor.detach().cpu().contiguous() for name, tensor in compressed.state_dict().items()}
+        torch.save(state_dict, args.output)
+        print(f"Saved compressed checkpoint to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Converts a .pth checkpoint into a memory-mappable format.
+
+The output format follows the destination extension:
+
+* ``.safetensors`` - requires the safetensors package; loaded zero-copy via mmap
+* ``.pth``         - re-saved in torch's zip format so ``torch.load(mmap=True)`` works
+
+Point ``pth_path`` in model_settings.yaml at the converted file.
+
+Usage:
+    python convert_checkpoint.py hnet.pth hnet.safetensors
+"""
+import argparse
+import os
+import time
+
+import torch
+
+
+def extract_state_dict(checkpoint: dict) -> dict:
+    """Returns the tensor state dict from a raw or wrapped training checkpoint.
+
+    :param checkpoint: Object loaded from a .pth file
+    :type checkpoint: dict
+    :return: Mapping of parameter names to tensors
+    :rtype: dict
+    """
+    for key in ('state_dict', 'model_state_dict', 'model'):
+        if isinstance(checkpoint, dict) and isinstance(checkpoint.get(key), dict):
+            checkpoint = checkpoint[key]
+            break
+    return {name: tensor for name, tensor in checkpoint.items() if isinstance(tensor, torch.Tensor)}
+
+
+def convert(src: str, dst: str):
+    """Converts src into the format implied by the extension of dst.
+
+    :param src: Existing checkpoint path
+    :type src: str
+    :param dst: Output path ending in .safetensors or .pth
+    :type dst: str
+    """
+    state_dict = extract_state_dict(torch.load(src, map_location='cpu'))
+    # Both formats want contiguous tensors that do not share storage
+    state_dict = {name: tensor.detach().contiguous().clone() for name, tensor in state_dict.items()}
+
+    if dst.endswith('.safetensors'):
+        try:
+            from safetensors.torch import save_file
+        except ImportError:
+            raise SystemExit("Writing .safetensors requires the safetensors package (pip install safetensors)")
+        save_file(state_dict, dst)
+    else:
+        torch.save(state_dict, dst)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('src', type=str, help="Existing .pth checkpoint")
+    parser.add_argument('dst', type=str, help="Output path ending in .safetensors or .pth")
+    args = parser.parse_args()
+
+    if os.path.abspath(args.src) == os.path.abspath(args.dst):
+        parser.error("src and dst must differ")
+    convert(args.src, args.dst)
+
+    from predictor import load_checkpoint
+    start = time.perf_counter()
+    state_dict = load_checkpoint(args.dst)
+    elapsed = time.perf_counter() - start
+    size_mb = sum(t.numel() * t.element_size() for t in state_dict.values()) / (1024 * 1024)
+    print(f"Wrote {args.dst}: {len(state_dict)} tensors, {size_mb:.1f} MB, reloads in {elapsed:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
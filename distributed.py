@@ -0,0 +1,431 @@
+"""Shards sliding-window inference of one large image across worker processes.
+
+A coordinator builds the image's tiling plan, splits its windows into shards
+of consecutive windows and sends each shard to an inference worker over
+HTTP. Workers run the model and return the kept region of every window; the
+coordinator blends them exactly as SlidingWindowCrop does. A shard whose
+worker fails or times out is put back in the queue and picked up by another
+worker; a worker that keeps failing is dropped.
+
+Wire format (no pickle): every request and response body is a 4-byte
+big-endian header length, a JSON header, then raw array bytes. A shard
+request carries the pixels of the shard's bounding box (uint8 H x W x 3) and
+the window and kept-region coordinates; the response carries the kept
+regions as float16, concatenated in window order.
+
+Usage:
+    # One worker per node (or several per host on different ports)
+    python distributed.py worker --port 9001 --threads 8
+
+    # Coordinate remote workers
+    python distributed.py predict big.png --workers http://node1:9001,http://node2:9001 --output mask.png
+
+    # Everything on one box: start 4 local workers, predict, stop them.
+    # --kill_worker_after kills one worker mid-run to exercise reassignment.
+    python distributed.py local big.png --workers 4 --output mask.png --kill_worker_after 5
+"""
+import os
+import sys
+import json
+import time
+import queue
+import struct
+import argparse
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+
+def pack_message(header: dict, payload: bytes = b'') -> bytes:
+    """Frames a JSON header and raw payload into one message body.
+
+    :param header: JSON serializable header
+    :type header: dict
+    :param payload: Raw array bytes following the header
+    :type payload: bytes
+    :return: The message body
+    :rtype: bytes
+    """
+    encoded = json.dumps(header).encode('utf-8')
+    return struct.pack('>I', len(encoded)) + encoded + payload
+
+
+def unpack_message(body: bytes) -> tuple:
+    """Splits a message body into its header and payload.
+
+    :param body: Message produced by pack_message
+    :type body: bytes
+    :return: (header, payload)
+    :rtype: tuple
+    """
+    (length,) = struct.unpack_from('>I', body)
+    return json.loads(body[4:4 + length].decode('utf-8')), memoryview(body)[4 + length:]
+
+
+class WorkerHandler(BaseHTTPRequestHandler):
+    """Serves /health and /windows for the Predictor in ``server.predictor``."""
+
+    def do_GET(self):
+        if self.path != '/health':
+            self.send_error(404)
+            return
+        self._reply(200, json.dumps(self.server.config).encode('utf-8'), 'application/json')
+
+    def do_POST(self):
+        from predictor import MemoryBudgetExceeded
+
+        if self.path != '/windows':
+            self.send_error(404)
+            return
+        try:
+            header, payload = unpack_message(self.rfile.read(int(self.headers['Content-Length'])))
+            h_origin, w_origin = header['origin']
+            pixels = np.frombuffer(payload, dtype=np.uint8).reshape(header['shape'])
+            windows = [(h0 - h_origin, w0 - w_origin, h1 - h_origin, w1 - w_origin)
+                       for h0, w0, h1, w1 in header['windows']]
+            keeps = [(h0 - h_origin, w0 - w_origin, h1 - h_origin, w1 - w_origin)
+                     for h0, w0, h1, w1 in header['keeps']]
+            outputs = self.server.predictor.predict_windows(pixels, windows, keeps)
+        except MemoryBudgetExceeded as e:
+            self._reply(413, str(e).encode('utf-8'), 'text/plain')
+            return
+        except Exception as e:
+            self._reply(500, str(e).encode('utf-8'), 'text/plain')
+            return
+        body = pack_message({'shapes': [list(output.shape) for output in outputs]},
+                            b''.join(output.numpy().astype(np.float16).tobytes() for output in outputs))
+        self._reply(200, body, 'application/octet-stream')
+
+    def _reply(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # One line per shard would drown the output
+
+
+def run_worker(args):
+    """Loads the model once and serves shard requests until interrupted."""
+    from predictor import Predictor
+
+    overrides = {'inference_mode': 'sliding'}
+    if args.threads:
+        overrides.update(intra_op_threads=args.threads, inter_op_threads=1)
+    predictor = Predictor(args.settings, settings_overrides=overrides)
+    server = ThreadingHTTPServer((args.host, args.port), WorkerHandler)
+    server.predictor = predictor
+    server.config = {
+        'model_type': predictor.model_settings['model_type'],
+        'window_size': predictor.predictor.window_size,
+        'overlap': predictor.predictor.overlap,
+        'tiling': predictor.predictor.tiling,
+        'context_margin': predictor.predictor.context_margin,
+        'mask_threshold': predictor.model_settings.get('mask_threshold', 0.5),
+        'prescreen_method': predictor.model_settings.get('prescreen_method'),
+        'prescreen_threshold': predictor.model_settings.get('prescreen_threshold', 0.02),
+    }
+    print(f"Worker listening on {args.host}:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+class Shard:
+    """Consecutive windows of a plan sent to one worker as a unit."""
+
+    def __init__(self, index: int, windows: list, keeps: list):
+        self.index = index
+        self.windows = windows
+        self.keeps = keeps
+        self.attempts = 0
+
+    def bounds(self) -> tuple:
+        """Returns the bounding box (h_start, w_start, h_end, w_end) of the shard's windows."""
+        return (min(w[0] for w in self.windows), min(w[1] for w in self.windows),
+                max(w[2] for w in self.windows), max(w[3] for w in self.windows))
+
+
+class Coordinator:
+    """Splits tiling plans into shards, dispatches them to workers and blends the results.
+
+    :param workers: Base URLs of the workers, e.g. http://node1:9001
+    :type workers: list[str]
+    :param shard_windows: Windows per shard
+    :type shard_windows: int
+    :param max_attempts: Tries per shard before the prediction fails
+    :type max_attempts: int
+    :param max_worker_failures: Consecutive failures after which a worker is dropped
+    :type max_worker_failures: int
+    :param timeout: Seconds to wait for one shard
+    :type timeout: float
+    """
+
+    def __init__(self, workers: list[str], shard_windows: int = 16, max_attempts: int = 3,
+                 max_worker_failures: int = 2, timeout: float = 300.0):
+        self.workers = [url.rstrip('/') for url in workers]
+        self.shard_windows = shard_windows
+        self.max_attempts = max_attempts
+        self.max_worker_failures = max_worker_failures
+        self.timeout = timeout
+        self.config = None
+
+    def connect(self) -> dict:
+        """Checks every worker and returns their shared tiling configuration.
+
+        Unreachable workers are dropped. Workers must agree on the settings
+        that determine the tiling plan.
+
+        :raises RuntimeError: If no worker is reachable or their settings differ
+        :return: The workers' configuration
+        :rtype: dict
+        """
+        reachable = []
+        for url in self.workers:
+            try:
+                with urllib.request.urlopen(url + '/health', timeout=10) as response:
+                    config = json.loads(response.read())
+            except (urllib.error.URLError, OSError) as e:
+                print(f"Dropping unreachable worker {url}: {e}")
+                continue
+            keys = ('model_type', 'window_size', 'overlap', 'tiling', 'context_margin', 'prescreen_method',
+                    'prescreen_threshold')
+            if self.config is not None and any(config[key] != self.config[key] for key in keys):
+                raise RuntimeError(f"Worker {url} is configured differently: {config} vs {self.config}")
+            self.config = config
+            reachable.append(url)
+        if not reachable:
+            raise RuntimeError("No reachable workers")
+        self.workers = reachable
+        return self.config
+
+    def predict(self, image: np.ndarray, info: dict = None) -> np.ndarray:
+        """Predicts a whole image across the workers.
+
+        :param image: Image as a uint8 (H, W, 3) array
+        :type image: np.ndarray
+        :param info: Optional dict filled with statistics about this prediction
+        :type info: dict
+        :raises RuntimeError: If a shard fails on every attempt or all workers are gone
+        :return: Probability map (H, W)
+        :rtype: np.ndarray
+        """
+        import torch
+        from predictor import TilingPlan
+
+        if self.config is None:
+            self.connect()
+        start = time.perf_counter()
+        H, W = image.shape[:2]
+        config = self.config
+        plan = TilingPlan(H, W, config['window_size'], config['overlap'],
+                          context_margin=config['context_margin'] if config['tiling'] == 'overlap_tile' else None)
+        shards = [Shard(i, plan.windows[s:s + self.shard_windows], plan.keeps[s:s + self.shard_windows])
+                  for i, s in enumerate(range(0, len(plan), self.shard_windows))]
+
+        prediction = torch.zeros((H, W))
+        pending = queue.Queue()
+        for shard in shards:
+            pending.put(shard)
+        lock = threading.Lock()
+        state = {'remaining': len(shards), 'error': None, 'retries': 0, 'live_workers': 0, 'per_worker': {}}
+        finished = threading.Event()
+
+        def blend(shard, outputs):
+            with lock:
+                for window, keep, output in zip(shard.windows, shard.keeps, outputs):
+                    prediction[keep[0]:keep[2], keep[1]:keep[3]].addcmul_(output, plan.keep_weight(window, keep))
+                state['remaining'] -= 1
+                if state['remaining'] == 0:
+                    finished.set()
+
+        def serve(url):
+            failures = 0
+            while not finished.is_set():
+                try:
+                    shard = pending.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                try:
+                    outputs = self._send(url, image, shard)
+                except Exception as e:
+                    failures += 1
+                    shard.attempts += 1
+                    with lock:
+                        state['retries'] += 1
+                        if shard.attempts >= self.max_attempts:
+                            state['error'] = f"Shard {shard.index} failed {shard.attempts} times, last on {url}: {e}"
+                            finished.set()
+                    pending.put(shard)  # Reassigned to whichever worker asks next
+                    if failures >= self.max_worker_failures:
+                        print(f"Dropping worker {url} after {failures} consecutive failures: {e}")
+                        break
+                    continue
+                failures = 0
+                blend(shard, outputs)
+                with lock:
+                    state['per_worker'][url] = state['per_worker'].get(url, 0) + 1
+            with lock:
+                state['live_workers'] -= 1
+                if state['live_workers'] == 0 and not finished.is_set():
+                    state['error'] = "All workers failed"
+                    finished.set()
+
+        threads = [threading.Thread(target=serve, args=(url,), daemon=True) for url in self.workers]
+        state['live_workers'] = len(threads)
+        for thread in threads:
+            thread.start()
+        finished.wait()
+        if state['error']:
+            raise RuntimeError(state['error'])
+
+        prediction *= plan.inv_weight_map
+        if info is not None:
+            info['windows'] = len(plan)
+            info['shards'] = len(shards)
+            info['retries'] = state['retries']
+            info['shards_per_worker'] = dict(state['per_worker'])
+            info['seconds'] = time.perf_counter() - start
+        return prediction.numpy()
+
+    def _send(self, url: str, image: np.ndarray, shard: Shard) -> list:
+        """Sends one shard to a worker and decodes the kept regions it returns."""
+        import torch
+
+        h_start, w_start, h_end, w_end = shard.bounds()
+        pixels = np.ascontiguousarray(image[h_start:h_end, w_start:w_end])
+        body = pack_message({
+            'origin': [h_start, w_start],
+            'shape': list(pixels.shape),
+            'windows': [list(window) for window in shard.windows],
+            'keeps': [list(keep) for keep in shard.keeps],
+        }, pixels.tobytes())
+        request = urllib.request.Request(url + '/windows', data=body, method='POST',
+                                         headers={'Content-Type': 'application/octet-stream'})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            header, payload = unpack_message(response.read())
+
+        outputs, offset = [], 0
+        for h, w in header['shapes']:
+            output = np.frombuffer(payload, dtype=np.float16, count=h * w, offset=offset).reshape(h, w)
+            outputs.append(torch.from_numpy(output.astype(np.float32)))
+            offset += h * w * 2
+        if len(outputs) != len(shard.windows):
+            raise RuntimeError(f"Expected {len(shard.windows)} outputs, got {len(outputs)}")
+        return outputs
+
+
+def save_prediction(prediction: np.ndarray, path: str, threshold: float):
+    """Writes the probability map as .npy, or a thresholded mask image otherwise."""
+    if path.endswith('.npy'):
+        np.save(path, prediction)
+    else:
+        cv2.imwrite(path, (prediction > threshold).astype(np.uint8) * 255)
+
+
+def run_prediction(args, workers: list[str]):
+    image = cv2.imread(args.image, cv2.IMREAD_COLOR)
+    if image is None:
+        raise SystemExit(f"Failed to read image: {args.image}")
+    coordinator = Coordinator(workers, shard_windows=args.shard_windows, max_attempts=args.max_attempts,
+                              timeout=args.timeout)
+    config = coordinator.connect()
+    print(f"Predicting {image.shape[1]}x{image.shape[0]} on {len(coordinator.workers)} workers")
+    info = {}
+    prediction = coordinator.predict(image, info=info)
+    print(f"Done: {info}")
+    if args.output:
+        save_prediction(prediction, args.output, config['mask_threshold'])
+        print(f"Saved to {args.output}")
+
+
+def run_local(args):
+    """Starts local worker processes, predicts across them and stops them."""
+    cores = os.cpu_count() or 1
+    threads = args.threads or max(1, cores // args.workers)
+    ports = [args.base_port + i for i in range(args.workers)]
+    processes = [subprocess.Popen([sys.executable, os.path.abspath(__file__), 'worker', '--host', '127.0.0.1',
+                                   '--port', str(port), '--settings', args.settings, '--threads', str(threads)])
+                 for port in ports]
+    urls = [f"http://127.0.0.1:{port}" for port in ports]
+    try:
+        # Wait until every worker has loaded its model
+        deadline = time.monotonic() + args.startup_timeout
+        for url, process in zip(urls, processes):
+            while True:
+                if process.poll() is not None:
+                    raise SystemExit(f"Worker {url} exited with code {process.returncode}")
+                try:
+                    urllib.request.urlopen(url + '/health', timeout=1).close()
+                    break
+                except (urllib.error.URLError, OSError):
+                    if time.monotonic() > deadline:
+                        raise SystemExit(f"Worker {url} did not start within {args.startup_timeout}s")
+                    time.sleep(0.2)
+        if args.kill_worker_after is not None:
+            threading.Timer(args.kill_worker_after, processes[0].kill).start()
+        run_prediction(args, urls)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    worker = commands.add_parser('worker', help="Serve shard requests with the configured model")
+    worker.add_argument('--host', default='0.0.0.0', type=str, help="Address to listen on")
+    worker.add_argument('--port', default=9001, type=int, help="Port to listen on")
+    worker.add_argument('--settings', default='model_settings.yaml', type=str,
+                        help="Path to the model settings YAML file")
+    worker.add_argument('--threads', default=None, type=int,
+                        help="Torch intra-op threads (default: from the settings)")
+
+    for name, text in (('predict', "Predict an image on running workers"),
+                       ('local', "Predict an image on local worker processes started for the run")):
+        command = commands.add_parser(name, help=text)
+        command.add_argument('image', type=str, help="Path to the input image")
+        command.add_argument('--output', default=None, type=str,
+                             help="Write the mask (.png) or probability map (.npy) here")
+        command.add_argument('--shard_windows', default=16, type=int, help="Windows per shard")
+        command.add_argument('--max_attempts', default=3, type=int, help="Tries per shard")
+        command.add_argument('--timeout', default=300.0, type=float, help="Seconds to wait for one shard")
+        if name == 'predict':
+            command.add_argument('--workers', required=True, type=lambda text: text.split(','),
+                                 help="Comma separated worker URLs")
+        else:
+            command.add_argument('--workers', default=2, type=int, help="Local worker processes")
+            command.add_argument('--base_port', default=9001, type=int, help="Port of the first worker")
+            command.add_argument('--settings', default='model_settings.yaml', type=str,
+                                 help="Path to the model settings YAML file")
+            command.add_argument('--threads', default=None, type=int,
+                                 help="Intra-op threads per worker (default: cores / workers)")
+            command.add_argument('--startup_timeout', default=120.0, type=float,
+                                 help="Seconds to wait for the workers to load the model")
+            command.add_argument('--kill_worker_after', default=None, type=float,
+                                 help="Kill the first worker after this many seconds (failure testing)")
+    args = parser.parse_args()
+
+    if args.command == 'worker':
+        run_worker(args)
+    elif args.command == 'predict':
+        run_prediction(args, args.workers)
+    else:
+        run_local(args)
+
+
+if __name__ == "__main__":
+    main()
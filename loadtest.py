@@ -0,0 +1,367 @@
+"""Load-tests a running instance of app.py with simulated annotator sessions.
+
+Each session behaves like an annotator working through a dataset: it lists
+the images and labels, opens an image and its label, requests predictions
+for crops of varied sizes and saves a label, with random think time between
+steps. Latency, throughput and error rate are reported per endpoint. Each
+session identifies itself with ``X-Client-Id``, so the app's per-client
+admission limit applies per simulated annotator; requests it rejects (429)
+are counted separately from errors.
+
+Predictions reference their crop of the dataset image (``source``), so the
+server loads the image itself and reuses cached windows, like the labelling
+UI; ``--pixel_crops`` uploads the crop pixels instead. Saved labels go to a
+separate dataset (``--label_dataset``, default ``loadtest``) as
+``<dataset>_<session>.png``, so real labels are never touched; delete
+``datasets/loadtest`` afterwards.
+
+Traces: ``--record trace.jsonl`` writes every operation with its start time,
+and ``--replay trace.jsonl`` re-issues exactly those operations on the same
+schedule (``--speed 2`` replays twice as fast). Prediction crops are stored as
+coordinates, not pixels, so traces stay small.
+
+Usage:
+    python app.py &
+    python loadtest.py --sessions 8 --duration 60 --record trace.jsonl
+    python loadtest.py --replay trace.jsonl --speed 2
+"""
+import re
+import json
+import time
+import base64
+import random
+import argparse
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+
+import cv2
+import numpy as np
+
+
+def parse_mix(text: str) -> dict:
+    """Parses operation weights such as "predict=3,save_label=1".
+
+    :param text: Comma separated name=weight pairs
+    :type text: str
+    :return: Operation names mapped to weights
+    :rtype: dict
+    """
+    mix = {}
+    for pair in text.split(','):
+        if pair.strip():
+            name, weight = pair.split('=')
+            mix[name.strip()] = float(weight)
+    return mix
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """Returns the nearest-rank percentile of a list of values.
+
+    :param values: Sorted values
+    :type values: list[float]
+    :param fraction: Percentile as a fraction, e.g. 0.95
+    :type fraction: float
+    :return: The percentile, or 0.0 for an empty list
+    :rtype: float
+    """
+    if not values:
+        return 0.0
+    rank = max(1, int(np.ceil(fraction * len(values))))
+    return values[rank - 1]
+
+
+class Client:
+    """Minimal HTTP client for the app's endpoints."""
+
+    def __init__(self, base_url: str, timeout: float = 120.0):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def request(self, method: str, path: str, body: dict = None, headers: dict = None) -> tuple:
+        """Sends a request and reads the whole response.
+
+        :return: (status code, response body); status 0 for connection errors
+        :rtype: tuple
+        """
+        data = None
+        headers = dict(headers or {})
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        url = self.base_url + urllib.parse.quote(path)
+        request = urllib.request.Request(url, data=data, method=method, headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+        except (urllib.error.URLError, OSError) as e:
+            return 0, str(e).encode('utf-8')
+
+
+class Recorder:
+    """Collects results and, optionally, the trace of executed operations."""
+
+    def __init__(self, record_path: str = None):
+        self.results = defaultdict(list)  # operation -> [(latency, status)]
+        self.trace = [] if record_path else None
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, session_id: int, operation: dict, started: float, latency: float, status: int):
+        with self._lock:
+            self.results[operation['op']].append((latency, status))
+            if self.trace is not None:
+                self.trace.append(dict(operation, session=session_id, t=round(started - self.start, 4)))
+
+    def report(self, elapsed: float) -> list[dict]:
+        """Summarizes latency, throughput and errors per operation.
+
+        :param elapsed: Wall time of the run in seconds
+        :type elapsed: float
+        :return: One row per operation plus a total row
+        :rtype: list[dict]
+        """
+        rows = []
+        everything = []
+        for name in sorted(self.results):
+            results = self.results[name]
+            everything += results
+            rows.append(self._row(name, results, elapsed))
+        rows.append(self._row('total', everything, elapsed))
+        return rows
+
+    @staticmethod
+    def _row(name: str, results: list, elapsed: float) -> dict:
+        latencies = sorted(latency for latency, status in results if 200 <= status < 300)
+        # Admission control rejections (429) are load shedding, not failures
+        throttled = sum(1 for _, status in results if status == 429)
+        errors = sum(1 for _, status in results if not 200 <= status < 300 and status != 429)
+        return {
+            'endpoint': name,
+            'requests': len(results),
+            'throttled': throttled,
+            'errors': errors,
+            'error_rate': errors / len(results) if results else 0.0,
+            'throughput': len(results) / elapsed if elapsed else 0.0,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+        }
+
+
+class Session:
+    """One simulated annotator, generating and executing operations."""
+
+    def __init__(self, session_id: int, client: Client, recorder: Recorder, args):
+        self.session_id = session_id
+        self.client = client
+        self.recorder = recorder
+        self.args = args
+        self.rng = random.Random(args.seed * 1000 + session_id)
+        # Admission control limits requests per client; each session is its own annotator
+        self.headers = {'X-Client-Id': f"loadtest-{session_id}"}
+        self.images = {}  # (dataset, filename) -> decoded image, for building crops
+
+    def execute(self, operation: dict):
+        """Issues the HTTP request for one operation and records its outcome."""
+        op = operation['op']
+        dataset = operation['dataset']
+        body, headers = None, None
+        if op == 'list_images':
+            method, path = 'GET', f"/datasets/{dataset}/images"
+        elif op == 'list_labels':
+            method, path = 'GET', f"/datasets/{dataset}/labels"
+        elif op == 'get_image':
+            method, path = 'GET', f"/datasets/{dataset}/images/{operation['filename']}"
+        elif op == 'get_label':
+            method, path = 'GET', f"/datasets/{dataset}/labels/{operation['filename']}"
+        elif op == 'predict':
+            x, y, w, h = operation['crop']
+            method, path = 'POST', '/predict'
+            if self.args.pixel_crops:
+                image = self.load_image(dataset, operation['filename'])
+                if image is None:
+                    return
+                _, encoded = cv2.imencode('.png', image[y:y + h, x:x + w])
+                body = {'image': 'data:image/png;base64,' + base64.b64encode(encoded).decode('utf-8')}
+            else:
+                body = {'source': {'dataset': dataset, 'filename': operation['filename'],
+                                   'x': x, 'y': y, 'width': w, 'height': h}}
+        elif op == 'save_label':
+            image = self.load_image(dataset, operation['source'])
+            if image is None:
+                return
+            _, encoded = cv2.imencode('.png', np.zeros(image.shape[:2], dtype=np.uint8))
+            # Traces recorded before labels moved to their own dataset lack label_dataset
+            label_dataset = operation.get('label_dataset', self.args.label_dataset)
+            method, path = 'POST', f"/datasets/{label_dataset}/labels/{operation['filename']}"
+            body = {'label': 'data:image/png;base64,' + base64.b64encode(encoded).decode('utf-8')}
+            headers = {'type': 'save'}
+        else:
+            raise ValueError(f"Unknown operation: {op}")
+
+        started = time.perf_counter()
+        headers = dict(self.headers, **(headers or {}))
+        status, response = self.client.request(method, path, body=body, headers=headers)
+        self.recorder.add(self.session_id, operation, started, time.perf_counter() - started, status)
+        return response if 200 <= status < 300 else None
+
+    def load_image(self, dataset: str, filename: str):
+        """Fetches and decodes an image once per session; not counted in the results."""
+        key = (dataset, filename)
+        if key not in self.images:
+            status, response = self.client.request('GET', f"/datasets/{dataset}/images/{filename}",
+                                                   headers=self.headers)
+            image = None
+            if status == 200:
+                image = cv2.imdecode(np.frombuffer(base64.b64decode(response), np.uint8), cv2.IMREAD_COLOR)
+            self.images[key] = image
+        return self.images[key]
+
+    def think(self):
+        if self.args.think_ms > 0:
+            time.sleep(self.rng.expovariate(1000.0 / self.args.think_ms))
+
+    def run(self, deadline: float):
+        """Works through random images of random datasets until the deadline."""
+        mix = self.args.mix
+        while time.perf_counter() < deadline:
+            dataset = self.rng.choice(self.args.datasets)
+            images = json.loads(self.execute({'op': 'list_images', 'dataset': dataset}) or '[]')
+            labels = json.loads(self.execute({'op': 'list_labels', 'dataset': dataset}) or '[]')
+            if not images:
+                self.think()
+                continue
+            filename = self.rng.choice(images)
+            self.execute({'op': 'get_image', 'dataset': dataset, 'filename': filename})
+            # Same matching rule as FileSystem.get_corr_label in the frontend
+            image_id = filename.split('.')[0]
+            label = next((name for name in labels if image_id in re.split(r'[_\-.]', name)), None)
+            if label:
+                self.execute({'op': 'get_label', 'dataset': dataset, 'filename': label})
+            self.think()
+
+            image = self.load_image(dataset, filename)
+            if image is None:
+                continue
+            height, width = image.shape[:2]
+            # On average mix['predict'] crops per opened image
+            predictions = round(self.rng.uniform(0, 2 * mix.get('predict', 0)))
+            for _ in range(predictions):
+                if time.perf_counter() >= deadline:
+                    return
+                side = self.rng.choice(self.args.crop_sizes)
+                w, h = min(side, width), min(side, height)
+                x, y = self.rng.randint(0, width - w), self.rng.randint(0, height - h)
+                self.execute({'op': 'predict', 'dataset': dataset, 'filename': filename, 'crop': [x, y, w, h]})
+                self.think()
+            if self.rng.random() < mix.get('save_label', 0):
+                self.execute({'op': 'save_label', 'dataset': dataset, 'source': filename,
+                              'label_dataset': self.args.label_dataset,
+                              'filename': f"{dataset}_{self.session_id}.png"})
+                self.think()
+
+    def replay(self, operations: list[dict], speed: float):
+        """Re-issues recorded operations on their recorded schedule."""
+        for operation in operations:
+            delay = self.recorder.start + operation['t'] / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self.execute({key: value for key, value in operation.items() if key not in ('t', 'session')})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:8000', type=str,
+                        help="Base URL of the running app")
+    parser.add_argument('--sessions', default=4, type=int,
+                        help="Concurrent annotator sessions")
+    parser.add_argument('--duration', default=60.0, type=float,
+                        help="Seconds to generate traffic for")
+    parser.add_argument('--datasets', default=None, type=lambda text: text.split(','),
+                        help="Comma separated datasets to use (default: all served by the app)")
+    parser.add_argument('--crop_sizes', default='64,128,256,512,1024',
+                        type=lambda text: [int(value) for value in text.split(',')],
+                        help="Comma separated side lengths of predicted crops")
+    parser.add_argument('--mix', default='predict=3,save_label=0.5', type=parse_mix,
+                        help="Mean predicted crops per opened image and probability of saving its label")
+    parser.add_argument('--pixel_crops', action='store_true',
+                        help="Upload crop pixels to /predict instead of referencing the dataset image")
+    parser.add_argument('--label_dataset', default='loadtest', type=str,
+                        help="Dataset that saved labels are written to, kept apart from real labels")
+    parser.add_argument('--think_ms', default=500.0, type=float,
+                        help="Mean think time between a session's requests, 0 disables")
+    parser.add_argument('--timeout', default=120.0, type=float,
+                        help="Per-request timeout in seconds")
+    parser.add_argument('--seed', default=0, type=int,
+                        help="Random seed for reproducible sessions")
+    parser.add_argument('--record', default=None, type=str,
+                        help="Write the executed operations to this JSONL trace")
+    parser.add_argument('--replay', default=None, type=str,
+                        help="Replay a JSONL trace instead of generating traffic")
+    parser.add_argument('--speed', default=1.0, type=float,
+                        help="Replay speed factor")
+    parser.add_argument('--json', action='store_true',
+                        help="Print the report as JSON")
+    args = parser.parse_args()
+
+    client = Client(args.url, timeout=args.timeout)
+    recorder = Recorder(args.record)
+
+    if args.replay:
+        with open(args.replay, 'r') as file:
+            operations = [json.loads(line) for line in file if line.strip()]
+        by_session = defaultdict(list)
+        for operation in operations:
+            by_session[operation.get('session', 0)].append(operation)
+        sessions = [(Session(session_id, client, recorder, args), ops) for session_id, ops in by_session.items()]
+        threads = [threading.Thread(target=session.replay, args=(sorted(ops, key=lambda op: op['t']), args.speed))
+                   for session, ops in sessions]
+        print(f"Replaying {len(operations)} operations from {len(sessions)} sessions at {args.speed}x")
+    else:
+        if args.datasets is None:
+            # The dataset page is HTML; dataset names are the values of its select options
+            status, response = client.request('GET', '/datasets')
+            if status != 200:
+                raise SystemExit(f"Could not list datasets at {args.url} (status {status})")
+            args.datasets = sorted(set(re.findall(r'<option value="([^"]+)"', response.decode('utf-8')))
+                                   - {args.label_dataset})
+            if not args.datasets:
+                raise SystemExit("No datasets found; pass --datasets")
+        deadline = time.perf_counter() + args.duration
+        threads = []
+        for session_id in range(args.sessions):
+            session = Session(session_id, client, recorder, args)
+            threads.append(threading.Thread(target=session.run, args=(deadline,)))
+        print(f"Running {args.sessions} sessions for {args.duration:.0f}s on datasets {args.datasets}")
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - recorder.start
+
+    rows = recorder.report(elapsed)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print(f"{'endpoint':<12} {'requests':>8} {'429s':>6} {'errors':>7} {'err%':>6} {'req/s':>7} "
+              f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for row in rows:
+            print(f"{row['endpoint']:<12} {row['requests']:>8} {row['throttled']:>6} {row['errors']:>7} "
+                  f"{row['error_rate'] * 100:>6.1f} {row['throughput']:>7.2f} "
+                  f"{row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f}")
+
+    if recorder.trace is not None:
+        with open(args.record, 'w') as file:
+            for operation in sorted(recorder.trace, key=lambda op: op['t']):
+                file.write(json.dumps(operation) + '\n')
+        print(f"Recorded {len(recorder.trace)} operations to {args.record}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Process memory measurement shared by the predictor and autotune.py."""
+import os
+import sys
+import threading
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def read_rss_bytes():
+    """Returns the resident set size of this process in bytes.
+
+    Reads ``/proc/self/statm`` where procfs exists. Elsewhere it falls back
+    to the process's peak RSS so far from ``getrusage``, and returns None
+    when neither is available (Windows).
+
+    :return: RSS in bytes, or None
+    :rtype: int
+    """
+    if os.path.exists('/proc/self/statm'):
+        with open('/proc/self/statm', 'r') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class PeakRSSSampler:
+    """Samples RSS on a background thread and keeps the peak seen.
+
+    ``start`` is the RSS when the block was entered, so ``peak - start`` is
+    the growth during the block. Both stay None when RSS cannot be read.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.start = None
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, read_rss_bytes())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.start = self.peak = read_rss_bytes()
+        if self.start is None:
+            return self
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._thread is None:
+            return False
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.peak = max(self.peak, read_rss_bytes())
+        return False
@@ -0,0 +1,109 @@
+"""Process-wide service metrics in the Prometheus text format.
+
+Counters and histograms are created on first use:
+
+    from metrics import metrics
+    metrics.increment('stream_requests_total')
+    metrics.observe('time_to_first_tile_seconds', 0.42)
+
+app.py serves them at ``/metrics``. With gunicorn every worker keeps its own
+registry, so a scrape reports the worker that answered it.
+"""
+import bisect
+import threading
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BYTES_BUCKETS = tuple(2 ** power for power in range(20, 36))  # 1 MiB to 32 GiB
+
+
+class Histogram:
+    """Cumulative histogram with fixed bucket upper bounds."""
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """Thread-safe registry of named counters and histograms."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+
+    def describe(self, name: str, text: str):
+        """Sets the HELP text shown for a metric.
+
+        :param name: Metric name
+        :type name: str
+        :param text: One line description
+        :type text: str
+        """
+        self._help[name] = text
+
+    def increment(self, name: str, value: float = 1):
+        """Adds value to a counter.
+
+        :param name: Counter name, conventionally ending in ``_total``
+        :type name: str
+        :param value: Amount to add
+        :type value: float
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float, buckets: tuple = DEFAULT_BUCKETS):
+        """Records a value in a histogram.
+
+        :param name: Histogram name, conventionally ending in the unit
+        :type name: str
+        :param value: Observed value
+        :type value: float
+        :param buckets: Bucket upper bounds, used when the histogram is created
+        :type buckets: tuple
+        """
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+
+    def render(self) -> str:
+        """Formats every metric in the Prometheus text exposition format.
+
+        :return: Exposition text
+        :rtype: str
+        """
+        lines = []
+        with self._lock:
+            for name, value in sorted(self._counters.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} counter")
+                lines.append(f"{name} {value}")
+            for name, histogram in sorted(self._histograms.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{le="+Inf"}} {histogram.count}')
+                lines.append(f"{name}_sum {histogram.sum}")
+                lines.append(f"{name}_count {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
@@ -0,0 +1,114 @@
+import torch
+import torch.nn as nn
+
+class LowRankConv2d(nn.Module):
+    """Rank-r factorization of a KxK convolution: a KxK convolution into r channels
+    followed by a 1x1 convolution back to the output channels.
+    Replaces C_out*C_in*K*K multiply-adds per pixel with r*(C_in*K*K + C_out).
+    """
+    def __init__(self, in_channels, out_channels, rank, kernel_size, stride=1, padding=0, dilation=1,
+                 bias=True, device=None):
+        super().__init__()
+        self.rank = rank
+        self.reduce = nn.Conv2d(in_channels, rank, kernel_size, stride=stride, padding=padding,
+                                dilation=dilation, bias=False, device=device)
+        self.expand = nn.Conv2d(rank, out_channels, 1, bias=bias, device=device)
+
+    def forward(self, x):
+        return self.expand(self.reduce(x))
+
+def choose_rank(singular_values, rank=None, energy=None):
+    """Rank to keep: a fixed rank, or the smallest rank retaining the given
+    fraction of the squared singular value energy"""
+    if rank is not None:
+        return max(1, min(rank, len(singular_values)))
+    cumulative = torch.cumsum(singular_values.double() ** 2, dim=0)
+    fraction = cumulative / cumulative[-1]
+    return int(torch.searchsorted(fraction, torch.tensor(energy, dtype=fraction.dtype)).item()) + 1
+
+def factorize_conv(conv, rank=None, energy=None):
+    """Factorizes a Conv2d with a truncated SVD of its (C_out, C_in*K*K) weight matrix.
+    Returns None when the chosen rank would not reduce the multiply-adds."""
+    if conv.groups != 1:
+        return None
+    out_channels, in_channels, kh, kw = conv.weight.shape
+    matrix = conv.weight.detach().double().reshape(out_channels, -1).cpu()
+    U, S, Vh = torch.linalg.svd(matrix, full_matrices=False)
+    r = choose_rank(S, rank=rank, energy=energy)
+    if r * (in_channels * kh * kw + out_channels) >= out_channels * in_channels * kh * kw:
+        return None
+
+    # Split the singular values evenly between the two factors
+    root = S[:r].sqrt()
+    reduce_weight = (root[:, None] * Vh[:r]).reshape(r, in_channels, kh, kw)
+    expand_weight = (U[:, :r] * root[None, :]).reshape(out_channels, r, 1, 1)
+
+    low_rank = LowRankConv2d(in_channels, out_channels, r, (kh, kw), stride=conv.stride, padding=conv.padding,
+                             dilation=conv.dilation, bias=conv.bias is not None, device=conv.weight.device)
+    dtype = conv.weight.dtype
+    with torch.no_grad():
+        low_rank.reduce.weight.copy_(reduce_weight.to(dtype))
+        low_rank.expand.weight.copy_(expand_weight.to(dtype))
+        if conv.bias is not None:
+            low_rank.expand.bias.copy_(conv.bias.detach())
+    return low_rank
+
+def _set_module(model, name, module):
+    parent_name, _, child = name.rpartition('.')
+    parent = model.get_submodule(parent_name) if parent_name else model
+    setattr(parent, child, module)
+
+def compress_model(model, targets, rank=None, energy=None, min_channels=1024):
+    """Replaces the KxK convolutions (K > 1) with at least min_channels input and output
+    channels inside the target submodules by low-rank factorizations.
+
+    Args:
+        model: Model to compress in place
+        targets: Names of the submodules to search, e.g. ('fine_bottleneck',)
+        rank: Fixed rank for every factorization
+        energy: Fraction of singular value energy to keep instead of a fixed rank
+
+    Returns:
+        List of dicts describing each factorized layer
+    """
+    if (rank is None) == (energy is None):
+        raise ValueError("Specify exactly one of rank or energy")
+    report = []
+    for name, module in list(model.named_modules()):
+        if not isinstance(module, nn.Conv2d) or not any(name == t or name.startswith(t + '.') for t in targets):
+            continue
+        if module.kernel_size == (1, 1) or min(module.in_channels, module.out_channels) < min_channels:
+            continue
+        low_rank = factorize_conv(module, rank=rank, energy=energy)
+        entry = {'layer': name, 'shape': list(module.weight.shape)}
+        if low_rank is None:
+            entry['skipped'] = 'rank too high to save compute'
+        else:
+            _set_module(model, name, low_rank)
+            entry['rank'] = low_rank.rank
+            entry['params'] = module.weight.numel()
+            entry['compressed_params'] = low_rank.reduce.weight.numel() + low_rank.expand.weight.numel()
+        report.append(entry)
+    return report
+
+def apply_low_rank_structure(model, state_dict):
+    """Replaces convolutions with LowRankConv2d wherever the state dict holds a
+    factorized layer (``<name>.reduce.weight``), so a compressed checkpoint loads
+    into the uncompressed architecture. Returns the names of the replaced layers."""
+    replaced = []
+    for key, weight in state_dict.items():
+        if not key.endswith('.reduce.weight'):
+            continue
+        name = key[:-len('.reduce.weight')]
+        conv = model.get_submodule(name)
+        if isinstance(conv, LowRankConv2d):
+            continue
+        expand_weight = state_dict[name + '.expand.weight']
+        low_rank = LowRankConv2d(conv.in_channels, conv.out_channels, weight.shape[0], conv.kernel_size,
+                                 stride=conv.stride, padding=conv.padding, dilation=conv.dilation,
+                                 bias=name + '.expand.bias' in state_dict, device=conv.weight.device)
+        if expand_weight.shape[1] != low_rank.rank:
+            raise ValueError(f"Inconsistent ranks for {name}")
+        _set_module(model, name, low_rank)
+        replaced.append(name)
+    return replaced
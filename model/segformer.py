@@ -7,6 +7,10 @@ import numpy as np
 from functools import partial
 
 
+# Upper bound on attention scores materialized at once in Attention, in bytes
+ATTENTION_CHUNK_BYTES = 64 * 1024 * 1024
+
+
 def _no_grad_trunc_normal_(tensor, mean, std, a, b):
     def norm_cdf(x):
         return (1. + math.erf(x / math.sqrt(2.))) / 2.
@@ -130,16 +134,38 @@ class Attention(nn.Module):
             kv = self.kv(x).reshape(B, -1, 2, self.num_heads, C // self.num_heads).permute(2, 0, 3, 1, 4)
         k, v = kv[0], kv[1]
 
-        attn = (q @ k.transpose(-2, -1)) * self.scale
-        attn = attn.softmax(dim=-1)
-        attn = self.attn_drop(attn)
+        if self.training and self.attn_drop.p > 0:
+            attn = (q @ k.transpose(-2, -1)) * self.scale
+            attn = attn.softmax(dim=-1)
+            attn = self.attn_drop(attn)
+            x = attn @ v
+        else:
+            x = self._chunked_attention(q, k, v)
 
-        x = (attn @ v).transpose(1, 2).reshape(B, N, C)
+        x = x.transpose(1, 2).reshape(B, N, C)
         x = self.proj(x)
         x = self.proj_drop(x)
 
         return x
 
+    def _chunked_attention(self, q, k, v):
+        # Process queries in chunks so at most ATTENTION_CHUNK_BYTES of scores exist at once
+        B, heads, N, _ = q.shape
+        chunk = max(1, ATTENTION_CHUNK_BYTES // (B * heads * k.shape[2] * q.element_size()))
+        if hasattr(F, 'scaled_dot_product_attention'):
+            # Fold the scale into q: SDPA itself always divides by sqrt(head_dim)
+            q = q * (self.scale * q.shape[-1] ** 0.5)
+
+        out = torch.empty_like(q)
+        for start in range(0, N, chunk):
+            q_chunk = q[:, :, start:start + chunk]
+            if hasattr(F, 'scaled_dot_product_attention'):
+                out[:, :, start:start + chunk] = F.scaled_dot_product_attention(q_chunk, k, v)
+            else:
+                attn = ((q_chunk @ k.transpose(-2, -1)) * self.scale).softmax(dim=-1)
+                out[:, :, start:start + chunk] = attn @ v
+        return out
+
 
 def drop_path(x, drop_prob: float = 0., training: bool = False, scale_by_keep: bool = True):
     if drop_prob == 0. or not training:
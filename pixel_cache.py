@@ -0,0 +1,145 @@
+"""Disk cache of decoded dataset images.
+
+Decoding a large JPEG or PNG takes 100+ ms, and the same dataset image is
+predicted again and again while it is being labelled. ``PixelCache.load``
+decodes an image once, stores the raw uint8 pixels as an ``.npy`` file and
+afterwards returns a memory-mapped view of that file, so repeated loads cost
+an ``os.stat`` and a page-cache lookup instead of a decode.
+
+Cache files are named after the source path, modification time and size, so
+an edited image misses the cache and its stale entry is deleted. The least
+recently used entries are evicted once the files exceed ``max_bytes``. The
+directory can be shared by several processes (e.g. gunicorn workers): entries
+are written atomically and recency is tracked with the files' mtimes.
+"""
+import os
+import hashlib
+import threading
+
+import cv2
+import numpy as np
+
+
+class PixelCache:
+    """Memory-mapped cache of decoded images.
+
+    :param root: Directory holding the ``.npy`` files
+    :type root: str
+    :param max_bytes: Size budget of the cache files
+    :type max_bytes: int
+    """
+
+    def __init__(self, root: str = '.pixel_cache', max_bytes: int = 2 * 1024 ** 3):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def load(self, path: str) -> tuple:
+        """Returns the decoded image at path, decoding it only on a cache miss.
+
+        The array is a copy-on-write memory map: reading it is zero-copy and
+        writes stay private to the caller.
+
+        :param path: Image file path
+        :type path: str
+        :raises FileNotFoundError: If the image does not exist
+        :return: (BGR uint8 (H, W, 3) array or None if undecodable, version
+            string that changes whenever the file does)
+        :rtype: tuple
+        """
+        stat = os.stat(path)
+        prefix = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()
+        version = f"{prefix}-{stat.st_mtime_ns}-{stat.st_size}"
+        entry = os.path.join(self.root, version + '.npy')
+        try:
+            image = np.load(entry, mmap_mode='c')
+            os.utime(entry)  # Mark as recently used
+            with self._lock:
+                self.hits += 1
+            return image, version
+        except (FileNotFoundError, ValueError):
+            pass  # Missing, evicted meanwhile or truncated
+
+        with self._lock:
+            self.misses += 1
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+        if image is None:
+            return None, version
+        self._remove_stale(prefix, version)
+        temporary = f"{entry}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            # Through a handle: np.save would append .npy to a bare file name
+            with open(temporary, 'wb') as file:
+                np.save(file, image)
+            os.replace(temporary, entry)
+        except OSError:
+            # A full or read-only disk only costs the cache, not the request
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            return image, version
+        self._evict()
+        try:
+            return np.load(entry, mmap_mode='c'), version
+        except FileNotFoundError:
+            return image, version  # Larger than the whole budget, or evicted by another process
+
+    def _remove_stale(self, prefix: str, version: str):
+        """Deletes entries of earlier versions of the same source file."""
+        for name in os.listdir(self.root):
+            if name.startswith(prefix + '-') and name.endswith('.npy') and name != version + '.npy':
+                try:
+                    os.remove(os.path.join(self.root, name))
+                except FileNotFoundError:
+                    pass
+
+    def _entries(self) -> list:
+        """Returns (mtime, size, path) of every cache file, least recently used first."""
+        entries = []
+        with os.scandir(self.root) as scan:
+            for entry in scan:
+                if entry.name.endswith('.npy'):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return sorted(entries)
+
+    def _evict(self):
+        """Deletes least recently used entries until the cache fits max_bytes."""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                # Views already handed out stay valid; the mapping outlives the file
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            total -= size
+            with self._lock:
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        """Reports hit rate, evictions and the size of the cache files.
+
+        :return: Cache statistics
+        :rtype: dict
+        """
+        entries = self._entries()
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests if requests else 0.0,
+                'evictions': self.evictions,
+                'entries': len(entries),
+                'bytes': sum(size for _, size, _ in entries),
+                'max_bytes': self.max_bytes,
+            }
@@ -1,43 +1,552 @@
+import os
+import socket
+import time
+import math
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import cv2
 import yaml
 import torch
 import numpy as np
 from torch.nn import functional as F
+
+from model.low_rank import apply_low_rank_structure
+from memory import PeakRSSSampler
+
+
 class Predictor:
-    def __init__(self, model_settings_path: str):
+    def __init__(self, model_settings_path: str, settings_overrides: dict = None, forward_slots=None):
         """Initializes the Predictor with a model and its settings.
 
         :param model_path: Path to the model file
         :type model_path: str
         :param model_settings_path: Path to the YAML file containing model settings
         :type model_settings_path: str
+        :param settings_overrides: Settings that take precedence over the YAML file
+        :type settings_overrides: dict
+        :param forward_slots: ForwardSlots shared with other Predictors, so their
+            forward passes count against one ``max_concurrent_forwards`` limit
+        :type forward_slots: ForwardSlots
         """
+        self._forward_slots = forward_slots or ForwardSlots()
         try:
             
             self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
             print(f"Using device: {self.device}")
             self.model_settings = self._load_model_settings(model_settings_path)
+            self._apply_tuning_cache(self.model_settings)
+            self.model_settings.update(settings_overrides or {})
+            self.configure_runtime()
             self.model = self._init_model(self.model_settings['model_type'], model_state_dict=None)
-            self.model.load_state_dict(torch.load(self.model_settings['pth_path'], map_location='cpu'))
+            start = time.perf_counter()
+            state_dict = load_checkpoint(self.model_settings['pth_path'])
+            # Checkpoints written by compress_hnet.py hold factorized layers
+            low_rank_layers = apply_low_rank_structure(self.model, state_dict)
+            load_weights(self.model, state_dict)
+            print(f"Loaded weights from {self.model_settings['pth_path']} in {time.perf_counter() - start:.2f}s"
+                  + (f" ({len(low_rank_layers)} low-rank layers)" if low_rank_layers else ""))
             self.model.eval()
+            pool_mb = self.model_settings.get('buffer_pool_mb', 256)
+            self.buffers = BufferPool(max_bytes=pool_mb * 1024 * 1024) if pool_mb else None
+            cache_mb = self.model_settings.get('window_cache_mb', 256)
+            self.window_cache = WindowCache(max_bytes=cache_mb * 1024 * 1024) if cache_mb else None
+            if self.model_settings.get('memory_format', 'contiguous') == 'channels_last':
+                self.model = self.model.to(memory_format=torch.channels_last)
             self.predictor = SlidingWindowCrop(
                 window_size=self.model_settings['window_size'],
                 overlap=self.model_settings['overlap'],
+                plan_cache_size=self.model_settings.get('plan_cache_size', 8),
+                plan_cache_bytes=self.model_settings.get('plan_cache_mb', 256) * 1024 * 1024,
+                screener=self._init_screener(self.model_settings),
+                tiling=self.model_settings.get('tiling', 'gaussian'),
+                context_margin=self._resolve_context_margin(self.model_settings),
+                batch_size=self.model_settings.get('batch_size', 1),
+                buffers=self.buffers,
             )
+            self.predictor.set_model_predictor(self._build_window_predictor(
+                self.model_settings.get('precision', 'fp32'),
+                self.model_settings.get('memory_format', 'contiguous'),
+            ))
             
         except Exception as e:
             raise RuntimeError(f"Failed to initialize Predictor: {e}")
 
-    def __call__(self, image: torch.Tensor) -> torch.Tensor:
+    def __call__(self, image: torch.Tensor, info: dict = None, output: str = 'probability',
+                 threshold: float = None, cancel=None, on_tile=None) -> np.ndarray:
         """Runs the model on the input tensor.
 
+        The output conversion happens in torch before the copy off the device,
+        so the uint8 modes never materialize a full-resolution float array in numpy.
+
         :param image: Input tensor to the model
         :type image: torch.Tensor
+        :param info: Optional dict filled with statistics about this prediction
+        :type info: dict
+        :param output: 'probability' (float32 in [0, 1]), 'uint8' (probability
+            quantized to 0-255) or 'mask' (uint8, 255 above threshold, 0 elsewhere)
+        :type output: str
+        :param threshold: Probability threshold for 'mask' output, defaults to
+            ``mask_threshold`` from the model settings
+        :type threshold: float
+        :param cancel: Optional callable polled between windows; when it returns
+            True the prediction stops with PredictionCancelled
+        :param on_tile: Optional callable (y, x, tile) receiving finished output tiles,
+            converted to the output mode, while the rest of the image is computed
+        :raises MemoryBudgetExceeded: If the estimated peak memory exceeds
+            ``request_memory_budget_mb`` in every allowed mode
         :return: Model output
+        :rtype: np.ndarray
+        """
+        if output not in OUTPUT_MODES:
+            raise ValueError(f"Unknown output mode '{output}', expected one of {OUTPUT_MODES}")
+        if threshold is None:
+            threshold = self.model_settings.get('mask_threshold', 0.5)
+        tile_callback = None
+        if on_tile is not None:
+            def tile_callback(h_start, w_start, h_end, w_end, tile):
+                on_tile(h_start, w_start, self._convert_tile(tile, output, threshold))
+
+        # Checked before waiting for a slot so oversized requests fail fast
+        mode = self.enforce_memory_budget(image, self._select_mode(image), output, info)
+        with self._forward_slots, torch.no_grad(), self._measure_memory(info):
+            # The request may have expired or been abandoned while waiting for a slot
+            check_cancelled(cancel)
+            if mode == 'whole_image':
+                output_map = self._predict_whole_image(image, info)
+                if tile_callback is not None:
+                    tile_callback(0, 0, output_map.shape[-2], output_map.shape[-1], output_map.unsqueeze(0))
+            elif mode == 'coarse_to_fine':
+                output_map = self._predict_coarse_to_fine(image, info, cancel=cancel, on_tile=tile_callback)
+            else:
+                output_map = self.predictor(self.model, image, info=info, cancel=cancel, on_tile=tile_callback)
+            if info is not None:
+                info['mode'] = mode
+            return self._to_numpy(output_map, output, threshold)
+
+    def predict_region(self, image, region: tuple, image_key: str, info: dict = None, output: str = 'probability',
+                       threshold: float = None, cancel=None) -> np.ndarray:
+        """Predicts a region of a larger image using windows on the image's global grid.
+
+        Windows are laid out for the whole image, not the region, so overlapping
+        regions of the same image share windows. Per-window outputs are cached
+        under (image_key, window, model config); only uncached windows run
+        through the model. The result equals the matching part of a sliding
+        prediction of the whole image.
+
+        :param image: The whole source image, numpy array (H, W, C) or tensor (C, H, W)
+        :param region: (y, x, height, width) of the region inside the image
+        :type region: tuple
+        :param image_key: Identifies the image content, e.g. a hash of its file
+        :type image_key: str
+        :param info: Optional dict filled with statistics about this prediction
+        :type info: dict
+        :param output: Output mode, see ``__call__``
+        :type output: str
+        :param threshold: Probability threshold for 'mask' output, see ``__call__``
+        :type threshold: float
+        :param cancel: Optional cancellation callable, see ``__call__``
+        :raises MemoryBudgetExceeded: If the estimated peak memory of the region exceeds ``request_memory_budget_mb``
+        :return: Prediction of the region
+        :rtype: np.ndarray
+        """
+        if output not in OUTPUT_MODES:
+            raise ValueError(f"Unknown output mode '{output}', expected one of {OUTPUT_MODES}")
+        if threshold is None:
+            threshold = self.model_settings.get('mask_threshold', 0.5)
+        y, x, height, width = region
+        self.enforce_memory_budget(image, 'sliding', output, info, region_size=(height, width))
+        with self._forward_slots, torch.no_grad(), self._measure_memory(info):
+            check_cancelled(cancel)
+            output_map = self.predictor.predict_region(
+                self.model, image, (y, x, y + height, x + width), window_cache=self.window_cache,
+                cache_key=(image_key,) + self._model_key(), info=info, cancel=cancel,
+            )
+            if info is not None:
+                info['mode'] = 'global_grid'
+            return self._to_numpy(output_map, output, threshold)
+
+    def predict_windows(self, image, windows: list, keeps: list) -> list:
+        """Runs the model on the given windows of an image and returns their kept regions.
+
+        Used by distributed workers, which receive windows of a plan built by the
+        coordinator rather than tiling the image themselves. Windows rejected by
+        the tile pre-screen return zeros, matching single-process inference.
+
+        :param image: Image containing every window, numpy array (H, W, C) or tensor (C, H, W)
+        :param windows: (h_start, w_start, h_end, w_end) of each window in image coordinates
+        :type windows: list
+        :param keeps: Kept region of each window, in image coordinates
+        :type keeps: list
+        :raises MemoryBudgetExceeded: If the estimated peak memory of the image exceeds ``request_memory_budget_mb``
+        :return: Float32 CPU tensor (h, w) of each kept region, in window order
+        :rtype: list
+        """
+        outputs = []
+        batch_size = self.predictor.batch_size
+        self.enforce_memory_budget(image, 'sliding', 'probability')
+        with self._forward_slots, torch.no_grad():
+            image = self.predictor.prepare(image)
+            screener = self.predictor.screener
+            for start in range(0, len(windows), batch_size):
+                chunk, window_batches = [], []
+                for window, keep in zip(windows[start:start + batch_size], keeps[start:start + batch_size]):
+                    window_batch = self.predictor.window_batch(image, *window, self.device)
+                    if screener is not None and not screener(self.model, window_batch):
+                        # Skipped windows contribute zero probability, as in SlidingWindowCrop.__call__
+                        self.predictor.release(window_batch)
+                        window_batch = None
+                    chunk.append((window, keep))
+                    window_batches.append(window_batch)
+                run = [batch for batch in window_batches if batch is not None]
+                if len({tuple(batch.shape) for batch in run}) <= 1:
+                    groups = [run] if run else []
+                else:
+                    groups = [[batch] for batch in run]  # Edge windows of small images
+                window_preds = []
+                for group in groups:
+                    batch = group[0] if len(group) == 1 else torch.cat(group)
+                    window_preds.extend(self.predictor._predict_window(self.model, batch))
+                for batch in run:
+                    self.predictor.release(batch)
+                window_preds = iter(window_preds)
+                for (window, keep), window_batch in zip(chunk, window_batches):
+                    if window_batch is None:
+                        outputs.append(torch.zeros((keep[2] - keep[0], keep[3] - keep[1])))
+                        continue
+                    window_pred = next(window_preds)
+                    outputs.append(window_pred[0, keep[0] - window[0]:keep[2] - window[0],
+                                               keep[1] - window[1]:keep[3] - window[1]].float().cpu())
+        return outputs
+
+    def _model_key(self) -> tuple:
+        """Returns the settings that determine per-window outputs, for cache keys.
+
+        :return: Model and tiling configuration
+        :rtype: tuple
+        """
+        settings = self.model_settings
+        return (settings['model_type'], settings['pth_path'], self.predictor.window_size, self.predictor.overlap,
+                self.predictor.tiling, self.predictor.context_margin, settings.get('precision', 'fp32'))
+
+    def predict_many(self, images, infos: list = None, output: str = 'probability', threshold: float = None,
+                     cancel=None):
+        """Predicts several images with sliding windows, pooling the windows of
+        all images into shared model batches of ``multi_image_batch_size``.
+
+        Predictions are yielded as soon as all windows of an image are done, so
+        callers can stream results while later images are still running.
+
+        :param images: Iterable of input images, numpy arrays (H, W, C) or tensors (C, H, W)
+        :param infos: Optional list of dicts, one per image, filled with per-image statistics
+        :type infos: list
+        :param output: Output mode, see ``__call__``
+        :type output: str
+        :param threshold: Probability threshold for 'mask' output, see ``__call__``
+        :type threshold: float
+        :param cancel: Optional cancellation callable, see ``__call__``
+        :raises MemoryBudgetExceeded: If an image's estimated peak memory exceeds ``request_memory_budget_mb``
+        :return: Generator of (index, prediction) pairs in completion order
+        """
+        if output not in OUTPUT_MODES:
+            raise ValueError(f"Unknown output mode '{output}', expected one of {OUTPUT_MODES}")
+        if threshold is None:
+            threshold = self.model_settings.get('mask_threshold', 0.5)
+        batch_size = self.multi_image_batch_size()
+
+        def within_budget(images):
+            # Checked as each image is drawn, before any of its windows run
+            for index, image in enumerate(images):
+                self.enforce_memory_budget(image, 'sliding', output, infos[index] if infos is not None else None,
+                                           batch_size=batch_size)
+                yield image
+
+        with self._forward_slots, torch.no_grad():
+            check_cancelled(cancel)
+            for index, output_map in self.predictor.predict_many(self.model, within_budget(images), infos=infos,
+                                                                 batch_size=batch_size, cancel=cancel):
+                if infos is not None:
+                    infos[index]['mode'] = 'sliding'
+                yield index, self._to_numpy(output_map, output, threshold)
+
+    def multi_image_batch_size(self) -> int:
+        """Returns the windows per model pass used by ``predict_many``."""
+        return self.model_settings.get('multi_image_batch_size') or self.predictor.batch_size
+
+    @staticmethod
+    def _convert_tile(tile: torch.Tensor, output: str, threshold: float) -> np.ndarray:
+        """Converts a (1, h, w) probability tile to the output mode as a (h, w) array.
+
+        :param tile: Normalized probability tile
+        :type tile: torch.Tensor
+        :param output: Output mode, see ``__call__``
+        :type output: str
+        :param threshold: Probability threshold for 'mask' output
+        :type threshold: float
+        :return: The converted tile
+        :rtype: np.ndarray
+        """
+        if output == 'mask':
+            tile = tile.gt(threshold).to(torch.uint8).mul_(255)
+        elif output == 'uint8':
+            tile = tile.mul(255).round_().to(torch.uint8)
+        return tile[0].cpu().numpy()
+
+    def _to_numpy(self, output_map: torch.Tensor, output: str, threshold: float) -> np.ndarray:
+        """Converts a probability map to the requested output mode and copies it off the device.
+
+        :param output_map: Probability map produced by one of the inference modes
+        :type output_map: torch.Tensor
+        :param output: Output mode, see ``__call__``
+        :type output: str
+        :param threshold: Probability threshold for 'mask' output
+        :type threshold: float
+        :return: The converted map
+        :rtype: np.ndarray
+        """
+        if output != 'probability':
+            output_map = self._convert_output(output_map, output, threshold)
+        result = output_map.cpu()
+        if result.data_ptr() != output_map.data_ptr():
+            self.release(output_map)  # Copied off the device; the device buffer can be reused
+        return result.numpy()
+
+    def _convert_output(self, probability: torch.Tensor, output: str, threshold: float) -> torch.Tensor:
+        """Converts a probability map into a uint8 map on its own device.
+
+        The probability map is consumed: it is modified in place and returned
+        to the buffer pool.
+
+        :param probability: Probability map produced by one of the inference modes
+        :type probability: torch.Tensor
+        :param output: 'uint8' or 'mask'
+        :type output: str
+        :param threshold: Probability threshold for 'mask' output
+        :type threshold: float
+        :return: uint8 map with the same shape
         :rtype: torch.Tensor
         """
-        with torch.no_grad():
-            output = self.predictor(self.model, image)
-            return output.cpu().numpy()
+        if self.buffers is not None:
+            result = self.buffers.acquire(probability.shape, dtype=torch.uint8, device=probability.device)
+        else:
+            result = torch.empty(probability.shape, dtype=torch.uint8, device=probability.device)
+        if output == 'mask':
+            # Compare straight into the uint8 buffer, then scale 0/1 to 0/255
+            torch.gt(probability, threshold, out=result.view(torch.bool))
+            result.mul_(255)
+        else:
+            result.copy_(probability.mul_(255).round_())
+        self.release(probability)
+        return result
+
+    def _select_mode(self, image) -> str:
+        """Chooses the inference mode for an image.
+
+        ``inference_mode: auto`` picks whole-image inference for models that
+        support it when the estimated activation memory of the padded image
+        fits ``whole_image_budget_mb``, and sliding windows otherwise.
+
+        :param image: Input image, numpy array (H, W, C) or tensor (C, H, W)
+        :return: One of 'whole_image', 'coarse_to_fine' or 'sliding'
+        :rtype: str
+        """
+        mode = self.model_settings.get('inference_mode', 'sliding')
+        if mode != 'auto':
+            return mode
+        model_type = self.model_settings['model_type'].lower()
+        if model_type not in WHOLE_IMAGE_MODELS:
+            return 'sliding'
+        H, W = self.predictor.image_size(image)
+        stride = REQUIRED_STRIDE[model_type]
+        estimate = estimate_activation_bytes(
+            model_type, -(-H // stride) * stride, -(-W // stride) * stride,
+            bytes_per_pixel=self.model_settings.get('activation_bytes_per_pixel'),
+        )
+        budget = self.model_settings.get('whole_image_budget_mb', 1024) * 1024 * 1024
+        return 'whole_image' if estimate <= budget else 'sliding'
+
+    def estimate_memory(self, height: int, width: int, mode: str = 'sliding', output: str = 'probability',
+                        batch_size: int = None, region_size: tuple = None) -> dict:
+        """Estimates the peak memory of predicting one (height, width) image.
+
+        Counts the uint8 input, the float32 probability map and tiling weights,
+        the uint8 output, and for each mode its model inputs and activations
+        (``estimate_activation_bytes``). Model weights and pooled idle buffers
+        are resident anyway and not counted.
+
+        :param height: Image height
+        :type height: int
+        :param width: Image width
+        :type width: int
+        :param mode: 'sliding', 'whole_image' or 'coarse_to_fine'
+        :type mode: str
+        :param output: Output mode, see ``__call__``
+        :type output: str
+        :param batch_size: Windows per model pass, defaults to ``batch_size``
+        :type batch_size: int
+        :param region_size: (h, w) of the predicted region when only a crop of
+            the image is predicted (``predict_region``)
+        :type region_size: tuple
+        :return: Estimated peak ``bytes`` and their breakdown in ``components``
+        :rtype: dict
+        """
+        model_type = self.model_settings['model_type'].lower()
+        bytes_per_pixel = self.model_settings.get('activation_bytes_per_pixel')
+        pixels = height * width
+        output_pixels = pixels if region_size is None else region_size[0] * region_size[1]
+        components = {
+            'image': pixels * 3,
+            'probability_map': output_pixels * 4,
+            'output': output_pixels if output != 'probability' else 0,
+        }
+        if mode == 'whole_image':
+            stride = REQUIRED_STRIDE[model_type]
+            padded_h, padded_w = -(-height // stride) * stride, -(-width // stride) * stride
+            components['model_input'] = padded_h * padded_w * 3 * 4
+            components['activations'] = estimate_activation_bytes(model_type, padded_h, padded_w,
+                                                                  bytes_per_pixel=bytes_per_pixel)
+        else:
+            window = self.predictor.window_size + (-self.predictor.window_size % 32)
+            batch_size = batch_size or self.predictor.batch_size
+            components['weight_map'] = pixels * 4
+            components['model_input'] = batch_size * window * window * 3 * 4
+            components['activations'] = estimate_activation_bytes(model_type, window, window, batch_size=batch_size,
+                                                                  bytes_per_pixel=bytes_per_pixel)
+            if mode == 'coarse_to_fine':
+                # The upsampled coarse map lives alongside the sliding pass
+                scale = self.model_settings.get('coarse_scale', 0.25)
+                coarse_h = max(32, int(round(height * scale / 32)) * 32)
+                coarse_w = max(32, int(round(width * scale / 32)) * 32)
+                components['coarse_map'] = pixels * 4
+                components['activations'] = max(components['activations'], estimate_activation_bytes(
+                    model_type, coarse_h, coarse_w, bytes_per_pixel=bytes_per_pixel))
+        return {'mode': mode, 'bytes': sum(components.values()), 'components': components}
+
+    def enforce_memory_budget(self, image, mode: str, output: str, info: dict = None, batch_size: int = None,
+                              region_size: tuple = None) -> str:
+        """Checks a request's estimated peak memory against ``request_memory_budget_mb``.
+
+        Over budget, ``memory_budget_action: reroute`` falls back to sliding
+        windows when their estimate fits; otherwise the request is rejected.
+
+        :param image: Input image, numpy array (H, W, C) or tensor (C, H, W)
+        :param mode: Inference mode chosen by ``_select_mode``
+        :type mode: str
+        :param output: Output mode, see ``__call__``
+        :type output: str
+        :param info: Optional dict receiving the estimate
+        :type info: dict
+        :param batch_size: Windows per model pass, see ``estimate_memory``
+        :type batch_size: int
+        :param region_size: Size of the predicted region, see ``estimate_memory``
+        :type region_size: tuple
+        :raises MemoryBudgetExceeded: If no mode fits the budget
+        :return: Inference mode to run
+        :rtype: str
+        """
+        budget_mb = self.model_settings.get('request_memory_budget_mb')
+        if not budget_mb:
+            return mode
+        budget = budget_mb * 1024 * 1024
+        H, W = self.predictor.image_size(image)
+        estimate = self.estimate_memory(H, W, mode, output, batch_size=batch_size, region_size=region_size)
+        if estimate['bytes'] > budget and mode != 'sliding' \
+                and self.model_settings.get('memory_budget_action', 'reroute') == 'reroute':
+            sliding = self.estimate_memory(H, W, 'sliding', output, batch_size=batch_size, region_size=region_size)
+            if sliding['bytes'] <= budget:
+                if info is not None:
+                    info['memory_rerouted_from'] = mode
+                mode, estimate = 'sliding', sliding
+        if info is not None:
+            info['estimated_peak_bytes'] = estimate['bytes']
+        if estimate['bytes'] > budget:
+            raise MemoryBudgetExceeded(estimate['bytes'], budget)
+        return mode
+
+    @contextmanager
+    def _measure_memory(self, info: dict = None):
+        """Adds the peak RSS, and on CUDA the peak tensor memory, of the enclosed block to info."""
+        if info is None:
+            yield
+            return
+        if self.device.type == 'cuda':
+            # Process-wide peak: concurrent forwards on the same GPU inflate each other's figure
+            torch.cuda.reset_peak_memory_stats(self.device)
+            tensor_base = torch.cuda.memory_allocated(self.device)
+        with PeakRSSSampler() as rss:
+            yield
+        if rss.peak is not None:
+            info['peak_rss_bytes'] = rss.peak
+            info['rss_growth_bytes'] = rss.peak - rss.start
+        if self.device.type == 'cuda':
+            info['peak_tensor_bytes'] = torch.cuda.max_memory_allocated(self.device) - tensor_base
+
+    def _predict_whole_image(self, image, info: dict = None) -> torch.Tensor:
+        """Runs the model once on the whole image, padded to the model's stride multiple.
+
+        :param image: Input image, numpy array (H, W, C) or tensor (C, H, W)
+        :param info: Optional dict filled with statistics about this prediction
+        :type info: dict
+        :return: Probability map (H, W)
+        :rtype: torch.Tensor
+        """
+        image = self.predictor.prepare(image)
+        H, W = self.predictor.image_size(image)
+        model_type = self.model_settings['model_type'].lower()
+        batch = self.predictor.window_batch(image, 0, 0, H, W, self.device,
+                                            multiple=REQUIRED_STRIDE[model_type])
+        if info is not None:
+            info['windows'] = 1
+            info['padded_size'] = list(batch.shape[2:])
+        output = self.predictor._predict_window(self.model, batch)[0, 0, :H, :W]
+        self.predictor.release(batch)
+        return output
+
+    def _predict_coarse_to_fine(self, image, info: dict = None, cancel=None, on_tile=None) -> torch.Tensor:
+        """Runs the model on a downscaled copy of the whole image, then refines
+        only the full-resolution windows whose coarse probability exceeds
+        ``refine_threshold``. Remaining windows keep the upsampled coarse map.
+
+        :param image: Input image, numpy array (H, W, C) or tensor (C, H, W)
+        :param info: Optional dict filled with statistics about this prediction
+        :type info: dict
+        :param cancel: Optional cancellation callable, see ``__call__``
+        :param on_tile: Optional tile callback, see ``SlidingWindowCrop.__call__``
+        :return: Merged probability map (H, W)
+        :rtype: torch.Tensor
+        """
+        scale = self.model_settings.get('coarse_scale', 0.25)
+        threshold = self.model_settings.get('refine_threshold', 0.3)
+
+        image = self.predictor.prepare(image)
+        H, W = self.predictor.image_size(image)
+        coarse_h = max(32, int(round(H * scale / 32)) * 32)
+        coarse_w = max(32, int(round(W * scale / 32)) * 32)
+        if isinstance(image, np.ndarray):
+            # Downscale while still uint8; only the small copy is converted to float
+            small = cv2.resize(image, (coarse_w, coarse_h), interpolation=cv2.INTER_AREA)
+        else:
+            small = F.interpolate(image.unsqueeze(0).float(), size=(coarse_h, coarse_w),
+                                  mode='bilinear', align_corners=False).squeeze(0)
+        small = self.predictor.window_batch(small, 0, 0, coarse_h, coarse_w, self.device)
+        coarse = self.predictor._predict_window(self.model, small)
+        self.predictor.release(small)
+        coarse = F.interpolate(coarse, size=(H, W), mode='bilinear', align_corners=False).squeeze(0)
+
+        def needs_refinement(h_start, w_start, h_end, w_end):
+            return coarse[:, h_start:h_end, w_start:w_end].max().item() > threshold
+
+        stats = {}
+        output = self.predictor(self.model, image, info=stats,
+                                window_filter=needs_refinement, fallback=coarse, cancel=cancel,
+                                on_tile=on_tile)
+        if info is not None:
+            info.update(stats)
+            info['coarse_scale'] = scale
+            info['refine_threshold'] = threshold
+            info['refined_fraction'] = 1.0 - stats['skip_rate']
+        return output
 
     def _load_model_settings(self, file_path):
         """Loads model settings from a YAML file.
@@ -55,6 +564,212 @@ class Predictor:
         except Exception as e:
             raise RuntimeError(f"Failed to load model settings: {e}")
         
+    def _apply_tuning_cache(self, settings: dict):
+        """Overrides settings with the autotuned values for this host, if any.
+
+        :param settings: Dictionary containing model settings, updated in place
+        :type settings: dict
+        """
+        if not settings.get('use_tuning_cache', True):
+            return
+        tuned = load_tuning_cache(tuning_cache_path(settings)).get(settings['model_type'].lower())
+        if not tuned:
+            return
+        applied = {key: tuned[key] for key in TUNED_SETTINGS if key in tuned}
+        settings.update(applied)
+        print(f"Loaded tuned settings for {socket.gethostname()}: {applied}")
+
+    def configure_runtime(self):
+        """Applies CPU affinity, torch thread counts and the forward-pass limiter.
+
+        Unset values are derived from the cores this process may run on:
+        ``max_concurrent_forwards`` defaults to one per 8 cores and
+        ``intra_op_threads`` splits the cores between those forwards, so
+        concurrent requests never oversubscribe the CPU.
+        """
+        settings = self.model_settings
+        cpus = self._apply_cpu_affinity(settings)
+        cores = len(cpus) if cpus else (os.cpu_count() or 1)
+
+        max_concurrent = settings.get('max_concurrent_forwards') or max(1, cores // 8)
+        intra_op_threads = settings.get('intra_op_threads') or max(1, cores // max_concurrent)
+        inter_op_threads = settings.get('inter_op_threads') or 1
+        torch.set_num_threads(intra_op_threads)
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError as e:
+            # Only allowed once per process, before any inter-op parallel work
+            print(f"Could not set inter-op threads: {e}")
+        self._forward_slots.resize(max_concurrent)
+
+        self.runtime = {
+            'device': str(self.device),
+            'cpus': cpus,
+            'numa_node': settings.get('numa_node'),
+            'intra_op_threads': torch.get_num_threads(),
+            'inter_op_threads': torch.get_num_interop_threads(),
+            'max_concurrent_forwards': max_concurrent,
+        }
+        print(f"Runtime configuration: {self.runtime}")
+
+    def _apply_cpu_affinity(self, settings: dict):
+        """Pins this process to ``cpu_affinity`` and/or the CPUs of ``numa_node``.
+
+        Only CPUs are pinned; memory then follows through first-touch allocation.
+
+        :param settings: Dictionary containing model settings
+        :type settings: dict
+        :return: Sorted CPU ids this process may run on, or None if unknown
+        :rtype: list[int]
+        """
+        if not hasattr(os, 'sched_setaffinity'):
+            return None
+        cpus = None
+        if settings.get('numa_node') is not None:
+            with open(f"/sys/devices/system/node/node{settings['numa_node']}/cpulist", 'r') as file:
+                cpus = parse_cpu_list(file.read())
+        if settings.get('cpu_affinity'):
+            requested = parse_cpu_list(settings['cpu_affinity'])
+            cpus = requested if cpus is None else cpus & requested
+        if cpus:
+            os.sched_setaffinity(0, cpus)
+        return sorted(os.sched_getaffinity(0))
+
+    def runtime_info(self) -> dict:
+        """Reports the effective runtime configuration and cache statistics.
+
+        :return: Runtime configuration
+        :rtype: dict
+        """
+        info = dict(self.runtime, plan_cache=self.predictor.plan_cache_info())
+        if self.buffers is not None:
+            info['buffer_pool'] = self.buffers.stats()
+        if self.window_cache is not None:
+            info['window_cache'] = self.window_cache.stats()
+        return info
+
+    def release(self, buffer):
+        """Returns a prediction (or any pooled buffer) to the buffer pool once
+        the caller is done with it, e.g. after the response is encoded.
+
+        :param buffer: Array or tensor previously returned by this Predictor
+        """
+        if self.buffers is not None:
+            self.buffers.release(buffer)
+
+    def _init_screener(self, settings: dict):
+        """Builds the optional tile pre-screen from the model settings.
+
+        :param settings: Dictionary containing model settings
+        :type settings: dict
+        :return: A TileScreener, or None when pre-screening is disabled
+        :rtype: TileScreener
+        """
+        method = settings.get('prescreen_method')
+        if not method:
+            return None
+        return TileScreener(
+            method=method,
+            threshold=settings.get('prescreen_threshold', 0.02),
+        )
+
+    def _build_window_predictor(self, precision: str, memory_format: str):
+        """Builds the window prediction function for a precision and memory layout.
+
+        Inputs are converted to ``memory_format`` and the forward pass runs
+        under bfloat16 autocast when ``precision`` is 'bf16'. Probabilities are
+        always returned as contiguous fp32 so blending stays in fp32.
+
+        :param precision: 'fp32' or 'bf16'
+        :type precision: str
+        :param memory_format: 'contiguous' or 'channels_last'
+        :type memory_format: str
+        :return: Function (model, window_batch) -> probabilities
+        """
+        if precision not in ('fp32', 'bf16'):
+            raise ValueError(f"Unsupported precision: {precision}")
+        if memory_format not in ('contiguous', 'channels_last'):
+            raise ValueError(f"Unsupported memory format: {memory_format}")
+        layout = torch.channels_last if memory_format == 'channels_last' else torch.contiguous_format
+
+        def predict_window(model, window_batch):
+            window_batch = window_batch.contiguous(memory_format=layout)
+            with torch.autocast(device_type=self.device.type, dtype=torch.bfloat16,
+                                enabled=precision == 'bf16'):
+                logits = model(window_batch)
+            return torch.sigmoid(logits.float()).contiguous()
+
+        return predict_window
+
+    def check_execution_mode(self, image, precision: str, memory_format: str,
+                             threshold: float = 0.5) -> dict:
+        """Compares an execution mode against fp32/contiguous on one image.
+
+        Use it to decide per model whether bf16 or channels-last is safe to enable.
+
+        :param image: Input image, numpy array (H, W, C) or tensor (C, H, W)
+        :param precision: 'fp32' or 'bf16'
+        :type precision: str
+        :param memory_format: 'contiguous' or 'channels_last'
+        :type memory_format: str
+        :param threshold: Probability threshold used for the mask IoU
+        :type threshold: float
+        :return: Probability differences, mask IoU and timings of both modes
+        :rtype: dict
+        """
+        configured = self.predictor._predict_window
+        configured_format = self.model_settings.get('memory_format', 'contiguous')
+        layouts = {'contiguous': torch.contiguous_format, 'channels_last': torch.channels_last}
+        results = {}
+        try:
+            for name, mode in (('reference', ('fp32', 'contiguous')), ('candidate', (precision, memory_format))):
+                self.predictor.set_model_predictor(self._build_window_predictor(*mode))
+                # The weights must be in the same layout as the inputs for the mode to run as configured
+                self.model = self.model.to(memory_format=layouts[mode[1]])
+                start = time.perf_counter()
+                results[name] = torch.from_numpy(self(image))
+                results[f'{name}_seconds'] = time.perf_counter() - start
+        finally:
+            self.predictor.set_model_predictor(configured)
+            self.model = self.model.to(memory_format=layouts[configured_format])
+
+        reference, candidate = results['reference'], results['candidate']
+        diff = (candidate - reference).abs()
+        reference_mask, candidate_mask = reference > threshold, candidate > threshold
+        union = (reference_mask | candidate_mask).sum().item()
+        return {
+            'precision': precision,
+            'memory_format': memory_format,
+            'max_abs_diff': diff.max().item(),
+            'mean_abs_diff': diff.mean().item(),
+            'mask_iou': (reference_mask & candidate_mask).sum().item() / union if union else 1.0,
+            'reference_seconds': results['reference_seconds'],
+            'candidate_seconds': results['candidate_seconds'],
+            'speedup': results['reference_seconds'] / results['candidate_seconds'],
+        }
+
+    def _resolve_context_margin(self, settings: dict) -> int:
+        """Determines the overlap-tile context margin for the configured model.
+
+        ``context_margin`` may be an integer, ``auto`` to probe it against
+        whole-image inference, or omitted to use the per-model default.
+
+        :param settings: Dictionary containing model settings
+        :type settings: dict
+        :return: Context margin in pixels
+        :rtype: int
+        """
+        if settings.get('tiling', 'gaussian') != 'overlap_tile':
+            return 0
+        margin = settings.get('context_margin')
+        if margin == 'auto':
+            margin = probe_context_margin(self.model, settings['window_size'],
+                                          tolerance=settings.get('context_tolerance', 0.01))
+            print(f"Probed context margin: {margin}")
+        elif margin is None:
+            margin = CONTEXT_MARGINS[settings['model_type'].lower()]
+        return margin
+
     def _init_model(self, model_type:str, model_state_dict:dict):
         model_type = model_type.lower()
         if model_type == 'hnet':
@@ -82,118 +797,1251 @@ class Predictor:
                 raise RuntimeError(f"Failed to load model state dict: {e}")
         return model.to(self.device)
 
+
+class ReloadingPredictor:
+    """Predictor that reloads itself when model_settings.yaml or the checkpoint changes.
+
+    A background thread polls the modification times of the settings file and
+    the active checkpoint. After a change has settled, it builds a new
+    Predictor, runs a warm-up forward and swaps it in atomically; requests
+    already running finish on the old one, which is dropped once they drain.
+    If loading or warm-up fails, the old Predictor stays active.
+
+    Calls and attribute lookups are forwarded to the active Predictor, so it
+    can be used in place of one.
+    """
+
+    def __init__(self, model_settings_path: str, settings_overrides: dict = None):
+        """Loads the initial Predictor; failures propagate as from Predictor.
+
+        :param model_settings_path: Path to the YAML file containing model settings
+        :type model_settings_path: str
+        :param settings_overrides: Settings that take precedence over the YAML file,
+            also for reloaded predictors
+        :type settings_overrides: dict
+        """
+        self.model_settings_path = model_settings_path
+        self.settings_overrides = dict(settings_overrides or {})
+        self._lock = threading.Condition()
+        self._version = 0
+        self._leases = {}  # version -> requests running on that version
+        self._watcher = None
+        self._stop = threading.Event()
+        self.last_error = None
+        # One limiter for every generation, so a draining model and its
+        # replacement share max_concurrent_forwards
+        self.forward_slots = ForwardSlots()
+        self._current = self._load()
+        self._signature = self._file_signature(self._current)
+        self._failed_signature = None
+
+    def _load(self) -> dict:
+        """Builds and warms up a new Predictor.
+
+        :return: Generation record holding the Predictor and its version
+        :rtype: dict
+        """
+        predictor = Predictor(self.model_settings_path, settings_overrides=self.settings_overrides,
+                              forward_slots=self.forward_slots)
+        # Warm-up: one window through the full pipeline, also validates the new weights
+        size = predictor.predictor.window_size
+        warmup = predictor(np.zeros((size, size, 3), dtype=np.uint8))
+        if not np.isfinite(warmup).all():
+            raise RuntimeError("Warm-up prediction is not finite")
+        with self._lock:
+            self._version += 1
+            return {
+                'predictor': predictor,
+                'version': self._version,
+                'pth_path': predictor.model_settings['pth_path'],
+                'loaded_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            }
+
+    def _file_signature(self, generation: dict) -> tuple:
+        """Returns (mtime, size) of the settings file and the checkpoint it points to."""
+        signature = []
+        for path in (self.model_settings_path, generation['pth_path']):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append(None)
+        # A changed pth_path is picked up through the settings file's mtime
+        return tuple(signature)
+
+    @contextmanager
+    def lease(self):
+        """Pins the active Predictor for the duration of a request.
+
+        :return: Context manager yielding the Predictor
+        """
+        with self._lock:
+            generation = self._current
+            version = generation['version']
+            self._leases[version] = self._leases.get(version, 0) + 1
+        try:
+            yield generation['predictor']
+        finally:
+            with self._lock:
+                self._leases[version] -= 1
+                if not self._leases[version]:
+                    del self._leases[version]
+                    self._lock.notify_all()
+
+    def __call__(self, *args, **kwargs):
+        with self.lease() as predictor:
+            return predictor(*args, **kwargs)
+
+    def predict_many(self, *args, **kwargs):
+        # The lease must cover the whole iteration, not just creating the generator
+        with self.lease() as predictor:
+            yield from predictor.predict_many(*args, **kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        attribute = getattr(self._current['predictor'], name)
+        if not callable(attribute):
+            return attribute
+
+        def leased(*args, **kwargs):
+            with self.lease() as predictor:
+                return getattr(predictor, name)(*args, **kwargs)
+        return leased
+
+    def runtime_info(self) -> dict:
+        """Reports the active Predictor's runtime information plus its version.
+
+        :return: Runtime configuration
+        :rtype: dict
+        """
+        with self.lease() as predictor:
+            return dict(predictor.runtime_info(), model_version=self.version_info())
+
+    def version_info(self) -> dict:
+        """Describes the active model version and the last reload failure.
+
+        :return: Version information
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'version': self._current['version'],
+                'pth_path': self._current['pth_path'],
+                'loaded_at': self._current['loaded_at'],
+                'draining_versions': sorted(v for v in self._leases if v != self._current['version']),
+                'last_error': self.last_error,
+            }
+
+    def reload(self) -> bool:
+        """Loads the current settings and checkpoint and swaps them in.
+
+        :return: True if the new Predictor is active, False if loading failed
+        :rtype: bool
+        """
+        try:
+            generation = self._load()
+        except Exception as e:
+            self.last_error = f"{time.strftime('%Y-%m-%dT%H:%M:%S')}: {e}"
+            print(f"Reload failed, keeping version {self._current['version']}: {e}")
+            return False
+        with self._lock:
+            old = self._current
+            self._current = generation
+            self.last_error = None
+        print(f"Swapped in model version {generation['version']} ({generation['pth_path']})")
+        if old['predictor'].buffers is not None:
+            # Draining requests allocate afresh rather than keep a second pool of idle buffers
+            old['predictor'].buffers.resize(0)
+        threading.Thread(target=self._drain, args=(old,), daemon=True).start()
+        return True
+
+    def _drain(self, generation: dict):
+        """Waits for requests on a retired generation to finish, then frees it."""
+        version = generation['version']
+        with self._lock:
+            while self._leases.get(version):
+                self._lock.wait()
+        # Dropping the last reference frees the model, its buffer pool and caches
+        del generation['predictor']
+        print(f"Model version {version} drained")
+
+    def start_watching(self):
+        """Starts the background watcher thread unless it is already running.
+
+        Threads do not survive fork(), so forked workers call this again.
+        """
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        self._stop.set()
+        if self._watcher is not None and self._watcher.is_alive():
+            self._watcher.join()
+        self._watcher = None
+
+    def _watch(self):
+        interval = self._current['predictor'].model_settings.get('reload_poll_seconds', 2)
+        settling = None
+        while not self._stop.wait(interval):
+            signature = self._file_signature(self._current)
+            if signature == self._signature or signature == self._failed_signature:
+                settling = None
+                continue
+            if signature != settling:
+                # Files may still be being written; wait until they stop changing
+                settling = signature
+                continue
+            settling = None
+            if self.reload():
+                self._signature = self._file_signature(self._current)
+                self._failed_signature = None
+            else:
+                self._failed_signature = signature
+
+
+def parse_cpu_list(cpus):
+    """
+    Parses a CPU list such as "0-3,8" (or a list of ids) into a set of CPU ids
+    """
+    if isinstance(cpus, int):
+        return {cpus}
+    if not isinstance(cpus, str):
+        return {int(cpu) for cpu in cpus}
+    result = set()
+    for part in cpus.strip().split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            result.update(range(int(first), int(last) + 1))
+        elif part:
+            result.add(int(part))
+    return result
+
+
+def load_checkpoint(path):
+    """
+    Loads a state dict, memory-mapping the weights instead of copying them where possible
+
+    ``.safetensors`` files are opened through safetensors, which maps the file.
+    Other checkpoints go through ``torch.load(mmap=True)``, which requires the
+    zip format written by torch >= 1.6 (see convert_checkpoint.py). Mapped pages
+    live in the page cache and are shared by every process loading the file.
+    """
+    if path.endswith('.safetensors'):
+        try:
+            from safetensors.torch import load_file
+        except ImportError:
+            raise RuntimeError("Loading .safetensors checkpoints requires the safetensors package")
+        return load_file(path, device='cpu')
+
+    try:
+        return torch.load(path, map_location='cpu', mmap=True, weights_only=True)
+    except Exception as e:
+        # Older torch, legacy (non-zip) files or pickled non-tensor objects
+        print(f"Memory-mapped load of {path} unavailable ({e}); falling back to a full load")
+        return torch.load(path, map_location='cpu')
+
+
+def load_weights(model, state_dict):
+    """
+    Loads a state dict into a model, adopting the given tensors instead of copying them on CPU
+    """
+    if next(model.parameters()).device.type == 'cpu':
+        try:
+            # assign=True keeps the (memory-mapped) tensors as the parameters themselves
+            return model.load_state_dict(state_dict, assign=True)
+        except TypeError:
+            pass  # torch < 2.1 has no assign argument
+    return model.load_state_dict(state_dict)
+
+
+# Settings the autotuner sweeps and persists per host
+TUNED_SETTINGS = ('window_size', 'batch_size', 'intra_op_threads', 'inter_op_threads')
+
+
+def tuning_cache_path(settings):
+    """
+    Returns the per-host tuning cache file for the given model settings
+    """
+    return os.path.join(settings.get('tuning_cache_dir', '.tuning'), f"{socket.gethostname()}.yaml")
+
+
+def load_tuning_cache(path):
+    """
+    Loads a tuning cache as {model_type: tuned settings}; empty when missing or unreadable
+    """
+    try:
+        with open(path, 'r') as file:
+            return yaml.safe_load(file) or {}
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"Ignoring unreadable tuning cache {path}: {e}")
+        return {}
+
+
+def save_tuning_result(path, model_type, result):
+    """
+    Stores the tuned settings of one model type in the tuning cache
+    """
+    cache = load_tuning_cache(path)
+    cache[model_type.lower()] = result
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as file:
+        yaml.safe_dump(cache, file, sort_keys=False)
+
+
+# Input size multiple each architecture needs (product of its downsampling strides)
+REQUIRED_STRIDE = {
+    'unet': 16,
+    'attention_unet': 16,
+    'deepcrack': 32,
+    'hnet': 32,
+    'segformer': 32,
+}
+
+# Models that can run on a whole image instead of fixed windows
+WHOLE_IMAGE_MODELS = ('unet', 'attention_unet', 'hnet', 'segformer')
+
+# Rough peak fp32 activation bytes per input pixel for a no-grad forward pass,
+# dominated by the full-resolution skip, upsampled and concatenated tensors of
+# the last decoder stage. Override with ``activation_bytes_per_pixel`` after
+# measuring peak RSS (e.g. with autotune.py) on the target host.
+ACTIVATION_BYTES_PER_PIXEL = {
+    'unet': 1536,
+    'attention_unet': 1792,
+    'deepcrack': 2048,
+    'hnet': 2048,
+    'segformer': 256,
+}
+
+
+def estimate_activation_bytes(model_type, height, width, batch_size=1, bytes_per_pixel=None):
+    """
+    Estimates peak activation memory of a forward pass over a (batch_size, 3, height, width) input
+    """
+    model_type = model_type.lower()
+    pixels = height * width
+    estimate = (bytes_per_pixel or ACTIVATION_BYTES_PER_PIXEL[model_type]) * pixels
+    if model_type == 'segformer':
+        # Stage-1 attention scores: HW/16 queries against HW/16/64 reduced keys, fp32,
+        # materialized in query chunks of at most ATTENTION_CHUNK_BYTES
+        from model.segformer import ATTENTION_CHUNK_BYTES
+        tokens = pixels / 16
+        estimate += min(tokens * (tokens / 64) * 4, ATTENTION_CHUNK_BYTES)
+    return int(estimate * batch_size)
+
+
+# Context margin (pixels on each side of a window) that each architecture needs
+# for its kept core to match whole-image inference, as a multiple of 32 so window
+# origins stay on the pooling grid. The U-Net and DeepCrack values are their
+# theoretical receptive field halved and rounded up. HNet's and SegFormer's are
+# empirical defaults, not derived: HNet's coarse path (5x5 convolutions with
+# dilation 8 at stride 16/32) has a receptive field far wider than 2 x 128, and
+# both also carry global context (average pooling / attention) that no finite
+# margin captures exactly. ``context_margin: auto`` probes the margin for the
+# loaded weights instead.
+CONTEXT_MARGINS = {
+    'unet': 96,
+    'attention_unet': 96,
+    'deepcrack': 128,
+    'hnet': 128,
+    'segformer': 64,
+}
+
+
+OUTPUT_MODES = ('probability', 'uint8', 'mask')
+
+
+class MemoryBudgetExceeded(Exception):
+    """Raised when a request's estimated peak memory exceeds ``request_memory_budget_mb``."""
+
+    def __init__(self, estimate, budget):
+        super().__init__(f"Estimated peak memory {estimate / 2**20:.0f} MB exceeds the "
+                         f"{budget / 2**20:.0f} MB request budget")
+        self.estimate = estimate
+        self.budget = budget
+
+
+class PredictionCancelled(Exception):
+    """Raised when a prediction is cancelled between windows."""
+
+
+def check_cancelled(cancel):
+    """
+    Raises PredictionCancelled when the optional cancel callable returns True
+    """
+    if cancel is not None and cancel():
+        raise PredictionCancelled("Prediction cancelled")
+
+
+class ForwardSlots:
+    """
+    Limits concurrent forward passes, like a semaphore whose limit can change while slots are held
+    """
+    def __init__(self, limit=1):
+        self.limit = limit
+        self.active = 0
+        self._condition = threading.Condition()
+
+    def resize(self, limit):
+        """
+        Sets the limit; running forwards finish, new ones wait until they fit under it
+        """
+        with self._condition:
+            self.limit = limit
+            self._condition.notify_all()
+
+    def __enter__(self):
+        with self._condition:
+            while self.active >= self.limit:
+                self._condition.wait()
+            self.active += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify_all()
+        return False
+
+
+class BufferPool:
+    """
+    Bounded pool of reusable tensors keyed by shape, dtype and device
+    """
+    MAX_LEASES = 1024
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        """
+        Args:
+            max_bytes: Upper bound on bytes retained by idle buffers (default 256 MB)
+        """
+        self.max_bytes = max_bytes
+        self._free = OrderedDict()  # key -> idle tensors, least recently used key first
+        self._leased = OrderedDict()  # data pointer -> (shape, dtype, device) of buffers handed out
+        self._lock = threading.Lock()
+        self.retained_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def acquire(self, shape, dtype=torch.float32, device='cpu', zero=False):
+        """
+        Returns a tensor of the given shape, reusing an idle one when available
+        """
+        key = (tuple(shape), dtype, str(device))
+        tensor = None
+        with self._lock:
+            idle = self._free.get(key)
+            if idle:
+                tensor = idle.pop()
+                self.retained_bytes -= tensor.numel() * tensor.element_size()
+                self._free.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if tensor is None:
+            tensor = torch.empty(key[0], dtype=dtype, device=device)
+        if zero:
+            tensor.zero_()
+        with self._lock:
+            self._leased[tensor.data_ptr()] = key
+            # Buffers that are never released must not grow the ledger forever
+            while len(self._leased) > self.MAX_LEASES:
+                self._leased.popitem(last=False)
+        return tensor
+
+    def release(self, buffer):
+        """
+        Returns a tensor, or a numpy array viewing one, to the pool
+
+        Buffers that were not handed out by this pool are ignored. Views are
+        accepted as long as they cover the whole buffer contiguously.
+        """
+        if isinstance(buffer, np.ndarray):
+            pointer = buffer.__array_interface__['data'][0]
+        else:
+            pointer = buffer.data_ptr()
+        with self._lock:
+            key = self._leased.pop(pointer, None)
+        if key is None:
+            return
+        tensor = torch.from_numpy(buffer) if isinstance(buffer, np.ndarray) else buffer
+        shape, dtype, device = key
+        if (tensor.dtype != dtype or str(tensor.device) != device or not tensor.is_contiguous()
+                or tensor.numel() != math.prod(shape)):
+            return
+        tensor = tensor.view(shape)
+
+        with self._lock:
+            nbytes = tensor.numel() * tensor.element_size()
+            if nbytes > self.max_bytes:
+                self.evictions += 1
+                return
+            # Evict idle buffers of the least recently used shapes until this one fits
+            while self.retained_bytes + nbytes > self.max_bytes and self._free:
+                old_key, idle = next(iter(self._free.items()))
+                evicted = idle.pop(0)
+                self.retained_bytes -= evicted.numel() * evicted.element_size()
+                self.evictions += 1
+                if not idle:
+                    del self._free[old_key]
+            self._free.setdefault(key, []).append(tensor)
+            self._free.move_to_end(key)
+            self.retained_bytes += nbytes
+
+    def resize(self, max_bytes):
+        """
+        Sets the retention bound, evicting idle buffers of the least recently used shapes to fit it
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            while self.retained_bytes > self.max_bytes and self._free:
+                old_key, idle = next(iter(self._free.items()))
+                evicted = idle.pop(0)
+                self.retained_bytes -= evicted.numel() * evicted.element_size()
+                self.evictions += 1
+                if not idle:
+                    del self._free[old_key]
+
+    def stats(self):
+        """
+        Returns hit rate, eviction count and bytes retained by idle buffers
+        """
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests if requests else 0.0,
+                'evictions': self.evictions,
+                'retained_bytes': self.retained_bytes,
+                'max_bytes': self.max_bytes,
+                'leased': len(self._leased),
+            }
+
+
+class WindowCache:
+    """
+    Bounded LRU cache of per-window model outputs, kept as float16 on the CPU
+    """
+    MISSING = object()
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        """
+        Args:
+            max_bytes: Upper bound on bytes of cached outputs (default 256 MB)
+        """
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> output tensor, or None for a window predicted as empty
+        self._lock = threading.Lock()
+        self.retained_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Returns the cached output for key, or WindowCache.MISSING
+        """
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return self.MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+    def put(self, key, output):
+        """
+        Caches a window output; None records a window that predicts zero everywhere
+        """
+        if output is not None:
+            output = output.detach().to('cpu', torch.float16)
+        nbytes = 0 if output is None else output.numel() * output.element_size()
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.retained_bytes -= old.numel() * old.element_size()
+            self._entries[key] = output
+            self.retained_bytes += nbytes
+            while self.retained_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                if evicted is not None:
+                    self.retained_bytes -= evicted.numel() * evicted.element_size()
+                self.evictions += 1
+
+    def stats(self):
+        """
+        Returns cache occupancy and hit/miss statistics
+        """
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'retained_mb': round(self.retained_bytes / (1024 * 1024), 1),
+                'max_mb': round(self.max_bytes / (1024 * 1024), 1),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+class TilingPlan:
+    """
+    Precomputed window layout and blending weights for one image shape
+    """
+    def __init__(self, height, width, window_size, overlap, device='cpu', context_margin=None):
+        """
+        Args:
+            height: Image height the plan covers
+            width: Image width the plan covers
+            window_size: Size of sliding window
+            overlap: Overlap ratio between windows (Gaussian blending only)
+            device: Device the weight tensors live on
+            context_margin: When set, build an overlap-tile plan instead: windows step by
+                window_size - 2 * context_margin and only their central core is kept
+        """
+        self.height = height
+        self.width = width
+        self.window_size = window_size
+        self.overlap = overlap
+        self.context_margin = context_margin
+
+        if context_margin is None:
+            stride = int(window_size * (1 - overlap))
+
+            # Window origins along each axis, clamped so the last window ends at the border.
+            # Clamping can map several indices onto the same origin, so duplicates are dropped.
+            h_starts = sorted({max(0, min(i * stride, height - window_size))
+                               for i in range((height + stride - 1) // stride)})
+            w_starts = sorted({max(0, min(i * stride, width - window_size))
+                               for i in range((width + stride - 1) // stride)})
+            self.windows = [
+                (h_start, w_start, min(h_start + window_size, height), min(w_start + window_size, width))
+                for h_start in h_starts
+                for w_start in w_starts
+            ]
+            self.keeps = list(self.windows)
+
+            # Gaussian weight for blending
+            coords = torch.arange(window_size, dtype=torch.float64)
+            center = window_size // 2
+            dist_sq = (coords[:, None] - center) ** 2 + (coords[None, :] - center) ** 2
+            self.blend_weight = torch.exp(-dist_sq / (2 * (center / 3) ** 2)).float().to(device)
+        else:
+            h_spans = self._overlap_tile_spans(height, window_size, context_margin)
+            w_spans = self._overlap_tile_spans(width, window_size, context_margin)
+            self.windows = [(h_win[0], w_win[0], h_win[1], w_win[1])
+                            for h_win, _ in h_spans for w_win, _ in w_spans]
+            self.keeps = [(h_keep[0], w_keep[0], h_keep[1], w_keep[1])
+                          for _, h_keep in h_spans for _, w_keep in w_spans]
+
+            # Cores tile the image, so every kept pixel counts once (twice where the last core is clamped)
+            self.blend_weight = torch.ones((window_size, window_size), device=device)
+
+        # Accumulate window weights once and keep the reciprocal for normalization
+        weight_map = torch.zeros((height, width), device=device)
+        for window, keep in zip(self.windows, self.keeps):
+            weight_map[keep[0]:keep[2], keep[1]:keep[3]] += self.keep_weight(window, keep)
+        weight_map[weight_map == 0] = 1  # Avoid division by zero
+        self.inv_weight_map = weight_map.reciprocal_()
+        # Tensor memory the plan pins while it is cached
+        self.nbytes = (self.inv_weight_map.numel() * self.inv_weight_map.element_size()
+                       + self.blend_weight.numel() * self.blend_weight.element_size())
+
+    @staticmethod
+    def _overlap_tile_spans(length, window_size, context_margin):
+        """
+        Returns ((window_start, window_end), (keep_start, keep_end)) pairs along one axis
+        """
+        core = window_size - 2 * context_margin
+        if core <= 0:
+            raise ValueError(f"context_margin {context_margin} leaves no core in a {window_size} window")
+        if length <= window_size:
+            return [((0, length), (0, length))]
+
+        spans = []
+        for core_start in range(0, length, core):
+            core_start = min(core_start, length - core)
+            # Shift windows at the borders inward; the image border then supplies the context
+            window_start = min(max(0, core_start - context_margin), length - window_size)
+            spans.append(((window_start, window_start + window_size), (core_start, core_start + core)))
+        return spans
+
+    def keep_weight(self, window, keep):
+        """
+        Returns the slice of the blending weight that applies to a window's kept region
+        """
+        h_start, w_start = window[0], window[1]
+        return self.blend_weight[keep[0] - h_start:keep[2] - h_start, keep[1] - w_start:keep[3] - w_start]
+
+    def tile_layout(self):
+        """
+        Returns the output tiles used for progressive streaming, built on first use
+
+        Tiles are the grid cells between consecutive kept-region origins, so a tile is
+        final once every window whose kept region overlaps it has been blended.
+
+        Returns:
+            tiles: List of (h_start, w_start, h_end, w_end)
+            window_tiles: For each window, the indices of the tiles its kept region overlaps
+            counts: For each tile, the number of windows overlapping it
+        """
+        if getattr(self, '_tile_layout', None) is None:
+            h_edges = sorted({keep[0] for keep in self.keeps} | {self.height})
+            w_edges = sorted({keep[1] for keep in self.keeps} | {self.width})
+            h_cells = list(zip(h_edges[:-1], h_edges[1:]))
+            w_cells = list(zip(w_edges[:-1], w_edges[1:]))
+            tiles = [(h0, w0, h1, w1) for h0, h1 in h_cells for w0, w1 in w_cells]
+            counts = [0] * len(tiles)
+            window_tiles = []
+            for keep in self.keeps:
+                overlapping = [
+                    i * len(w_cells) + j
+                    for i, (h0, h1) in enumerate(h_cells) if h0 < keep[2] and keep[0] < h1
+                    for j, (w0, w1) in enumerate(w_cells) if w0 < keep[3] and keep[1] < w1
+                ]
+                for tile in overlapping:
+                    counts[tile] += 1
+                window_tiles.append(overlapping)
+            self._tile_layout = (tiles, window_tiles, counts)
+        return self._tile_layout
+
+    def __len__(self):
+        return len(self.windows)
+
+
+class TileScreener:
+    """
+    Cheap pre-screen deciding which windows are worth a full model pass
+    """
+    METHODS = ('edge', 'variance', 'lowres')
+
+    def __init__(self, method='edge', threshold=0.02, edge_level=0.1, lowres_size=96):
+        """
+        Args:
+            method: Screening signal, one of 'edge', 'variance' or 'lowres'
+            threshold: Windows scoring below this are skipped
+            edge_level: Gradient magnitude counted as an edge by the 'edge' method
+            lowres_size: Side length of the downscaled window used by the 'lowres' method
+        """
+        if method not in self.METHODS:
+            raise ValueError(f"Unsupported prescreen method: {method}")
+        self.method = method
+        self.threshold = threshold
+        self.edge_level = edge_level
+        self.lowres_size = lowres_size
+
+    def score(self, model, window_batch):
+        """
+        Scores a (1, C, h, w) window; higher means more likely to contain cracks
+        """
+        if self.method == 'lowres':
+            # Tiny pass of the same model on a downscaled window, scored by its peak probability
+            small = F.interpolate(window_batch, size=(self.lowres_size, self.lowres_size),
+                                  mode='bilinear', align_corners=False)
+            return torch.sigmoid(model(small)).max().item()
+
+        gray = window_batch.mean(dim=1)
+        if self.method == 'variance':
+            return gray.std().item()
+
+        # Fraction of pixels whose local gradient exceeds edge_level
+        grad_h = (gray[:, 1:, :-1] - gray[:, :-1, :-1]).abs()
+        grad_w = (gray[:, :-1, 1:] - gray[:, :-1, :-1]).abs()
+        return ((grad_h + grad_w) > self.edge_level).float().mean().item()
+
+    def __call__(self, model, window_batch):
+        """
+        Returns True when the window should run through the full model
+        """
+        return self.score(model, window_batch) >= self.threshold
+
+
 class SlidingWindowCrop:
     """
     Perform inference on large images using sliding window approach
     """
-    def __init__(self, window_size=448, overlap=0.2):
+    def __init__(self, window_size=448, overlap=0.2, plan_cache_size=8, screener=None,
+                 tiling='gaussian', context_margin=0, batch_size=1, buffers=None,
+                 plan_cache_bytes=256 * 1024 * 1024):
         """
         Args:
             window_size: Size of sliding window (default 448)
             overlap: Overlap ratio between windows (default 0.2)
+            plan_cache_size: Number of tiling plans kept for reuse (default 8)
+            screener: Optional TileScreener; skipped windows predict zero probability
+            tiling: 'gaussian' blends overlapping windows, 'overlap_tile' keeps only
+                each window's core and ignores overlap (default 'gaussian')
+            context_margin: Context pixels around each core for 'overlap_tile' (default 0)
+            batch_size: Number of windows stacked into one model pass (default 1)
+            buffers: Optional BufferPool that window, batch and output tensors come from
+            plan_cache_bytes: Upper bound on the weight map bytes of cached plans (default 256 MB);
+                a plan larger than this is used but not cached
         """
+        if tiling not in ('gaussian', 'overlap_tile'):
+            raise ValueError(f"Unsupported tiling: {tiling}")
         self.window_size = window_size
         self.overlap = overlap
+        self.tiling = tiling
+        self.context_margin = context_margin
+        self.batch_size = batch_size
+        self.buffers = buffers
+        self.screener = screener
+        self.plan_cache_size = plan_cache_size
+        self.plan_cache_bytes = plan_cache_bytes
+        self._plan_cache_retained = 0
+        self._plan_cache = OrderedDict()
+        self._plan_cache_lock = threading.Lock()
+        self._plan_cache_hits = 0
+        self._plan_cache_misses = 0
+
+    def get_plan(self, height, width, device='cpu'):
+        """
+        Returns the cached tiling plan for an image shape, building it on a miss
+        """
+        context_margin = self.context_margin if self.tiling == 'overlap_tile' else None
+        key = (height, width, self.window_size, self.overlap, context_margin, str(device))
+        with self._plan_cache_lock:
+            plan = self._plan_cache.get(key)
+            if plan is not None:
+                self._plan_cache.move_to_end(key)
+                self._plan_cache_hits += 1
+                return plan
+            self._plan_cache_misses += 1
+
+        plan = TilingPlan(height, width, self.window_size, self.overlap, device=device,
+                          context_margin=context_margin)
+        if plan.nbytes > self.plan_cache_bytes:
+            return plan
+        with self._plan_cache_lock:
+            if key not in self._plan_cache:
+                self._plan_cache[key] = plan
+                self._plan_cache_retained += plan.nbytes
+            self._plan_cache.move_to_end(key)
+            while (len(self._plan_cache) > self.plan_cache_size
+                   or self._plan_cache_retained > self.plan_cache_bytes):
+                _, evicted = self._plan_cache.popitem(last=False)
+                self._plan_cache_retained -= evicted.nbytes
+        return plan
+
+    def plan_cache_info(self):
+        """
+        Returns hit/miss statistics and retained bytes of the tiling plan cache
+        """
+        with self._plan_cache_lock:
+            return {
+                'hits': self._plan_cache_hits,
+                'misses': self._plan_cache_misses,
+                'size': len(self._plan_cache),
+                'max_size': self.plan_cache_size,
+                'retained_bytes': self._plan_cache_retained,
+                'max_bytes': self.plan_cache_bytes,
+            }
     
-    def __call__(self, model, image):
+    def prepare(self, image):
+        """
+        Validates an input image; numpy images stay uint8 (H, W, C) and are converted per window
+
+        Args:
+            image: Input image tensor (C, H, W) or numpy array (H, W, C)
+
+        Returns:
+            image: The same image, untouched
+        """
+        if isinstance(image, np.ndarray):
+            if image.ndim != 3 or image.shape[2] != 3:
+                raise ValueError("Input image should be in H, W, C format for numpy arrays")
+        elif image.dim() != 3:
+            raise ValueError("Input image should be in C, H, W format for tensors")
+        return image
+
+    @staticmethod
+    def image_size(image):
+        """
+        Returns (H, W) of a numpy (H, W, C) or tensor (C, H, W) image
+        """
+        if isinstance(image, np.ndarray):
+            return image.shape[0], image.shape[1]
+        return image.shape[1], image.shape[2]
+
+    def acquire(self, shape, device, zero=False):
+        """
+        Returns a float tensor from the buffer pool, or a fresh one without a pool
+        """
+        if self.buffers is None:
+            return torch.zeros(shape, device=device) if zero else torch.empty(shape, device=device)
+        return self.buffers.acquire(shape, device=device, zero=zero)
+
+    def release(self, tensor):
+        """
+        Hands a tensor obtained from acquire() back to the buffer pool
+        """
+        if self.buffers is not None:
+            self.buffers.release(tensor)
+
+    def window_batch(self, image, h_start, w_start, h_end, w_end, device, multiple=32):
+        """
+        Cuts a window out of the image as a (1, C, h, w) float batch
+
+        Only the window is converted to float. Its height and width are padded up
+        to a multiple of ``multiple`` (default 32) for model compatibility; callers
+        crop the padding away.
+        """
+        if isinstance(image, np.ndarray):
+            source = torch.from_numpy(image[h_start:h_end, w_start:w_end]).permute(2, 0, 1)
+        else:
+            source = image[:, h_start:h_end, w_start:w_end]
+        window = self.acquire((1,) + tuple(source.shape), device)
+        window[0].copy_(source)
+        if isinstance(image, np.ndarray):
+            window.div_(255.0)
+
+        pad_h = -window.shape[2] % multiple
+        pad_w = -window.shape[3] % multiple
+        if pad_h or pad_w:
+            # Reflection needs the pad to be smaller than the window itself
+            mode = 'reflect' if pad_h < window.shape[2] and pad_w < window.shape[3] else 'replicate'
+            padded = F.pad(window, (0, pad_w, 0, pad_h), mode=mode)
+            self.release(window)
+            window = padded
+        return window
+
+    def __call__(self, model, image, info=None, window_filter=None, fallback=None, cancel=None, on_tile=None):
         """
         Args:
             model: Trained model
             image: Input image tensor (C, H, W) or numpy array (H, W, C)
+            info: Optional dict filled with per-call statistics
+            window_filter: Optional callable (h_start, w_start, h_end, w_end) -> bool
+                selecting which windows run through the model
+            fallback: Optional (1, H, W) probability map used for windows that are not run;
+                zero probability when omitted
+            cancel: Optional callable polled before every window; when it returns True
+                the call stops with PredictionCancelled and its buffers are released
+            on_tile: Optional callable (h_start, w_start, h_end, w_end, tile) receiving each
+                normalized (1, h, w) output tile as soon as all windows covering it are done
         
         Returns:
             prediction: Full resolution prediction tensor
         """
         device = next(model.parameters()).device
-        
-        # Handle both numpy arrays and tensors
-        if isinstance(image, np.ndarray):
-            # Convert numpy array to tensor
-            if len(image.shape) == 3 and image.shape[2] == 3:  # H, W, C format
-                image = torch.from_numpy(image.transpose(2, 0, 1)).float() / 255.0
-            else:
-                raise ValueError("Input image should be in H, W, C format for numpy arrays")
-        
-        # Resize to multiples of 32 for model compatibility
-        C, H, W = image.shape
-        new_h = (H // 32) * 32
-        new_w = (W // 32) * 32
-        
-        if H != new_h or W != new_w:
-            image = F.interpolate(image.unsqueeze(0), size=(new_h, new_w), mode='bilinear', align_corners=False).squeeze(0)
-            H, W = new_h, new_w
+        image = self.prepare(image)
+        H, W = self.image_size(image)
 
-        stride = int(self.window_size * (1 - self.overlap))
-        
-        # Ensure complete coverage by calculating windows differently
-        h_windows = (H + stride - 1) // stride
-        w_windows = (W + stride - 1) // stride
-        
-        # Initialize prediction and weight maps
-        prediction = torch.zeros((1, H, W), device=device)
-        weight_map = torch.zeros((H, W), device=device)
+        plan = self.get_plan(H, W, device)
+        prediction = self.acquire((1, H, W), device, zero=True)
+        skipped = 0
         
-        # Create Gaussian weight for blending
-        gaussian_weight = torch.ones((self.window_size, self.window_size), device=device)
-        center = self.window_size // 2
-        for i in range(self.window_size):
-            for j in range(self.window_size):
-                dist = ((i - center) ** 2 + (j - center) ** 2) ** 0.5
-                gaussian_weight[i, j] = np.exp(-(dist ** 2) / (2 * (center / 3) ** 2))
+        pending = []  # (plan, prediction, window, keep, window_batch) waiting for a model pass
+        pending_indices = []
+
+        if on_tile is not None:
+            tiles, window_tiles, counts = plan.tile_layout()
+            remaining = list(counts)
+
+        def windows_done(indices):
+            if on_tile is None:
+                return
+            for index in indices:
+                for tile in window_tiles[index]:
+                    remaining[tile] -= 1
+                    if remaining[tile] == 0:
+                        t_h_start, t_w_start, t_h_end, t_w_end = tiles[tile]
+                        on_tile(t_h_start, t_w_start, t_h_end, t_w_end,
+                                prediction[:, t_h_start:t_h_end, t_w_start:t_w_end]
+                                * plan.inv_weight_map[t_h_start:t_h_end, t_w_start:t_w_end])
         
         model.eval()
-        with torch.no_grad():
-            for h_idx in range(h_windows):
-                for w_idx in range(w_windows):
-                    # Calculate window coordinates ensuring full coverage
-                    h_start = min(h_idx * stride, H - self.window_size)
-                    w_start = min(w_idx * stride, W - self.window_size)
-                    
-                    # Ensure we don't go beyond image boundaries
-                    h_start = max(0, h_start)
-                    w_start = max(0, w_start)
-                    h_end = min(h_start + self.window_size, H)
-                    w_end = min(w_start + self.window_size, W)
-                    
-                    # Extract window with proper padding if needed
-                    if h_end - h_start < self.window_size or w_end - w_start < self.window_size:
-                        # Pad the window to ensure it's exactly window_size x window_size
-                        window = image[:, h_start:h_end, w_start:w_end]
-                        pad_h = max(0, self.window_size - (h_end - h_start))
-                        pad_w = max(0, self.window_size - (w_end - w_start))
-
-                        # Use reflection padding instead of zero padding
-                        # window = F.pad(window, (0, pad_w, 0, pad_h), mode='reflect')
-                    else:
-                        window = image[:, h_start:h_end, w_start:w_end]
-                    
-                    window_batch = window.unsqueeze(0).to(device)
-                    
-                    # Get prediction for window - this will be handled by the caller
-                    window_pred = self._predict_window(model, window_batch)
-                    window_pred = window_pred.squeeze(0)
-                    
-                    # Crop prediction back to actual window size if we padded
-                    actual_h = h_end - h_start
-                    actual_w = w_end - w_start
-                    window_pred = window_pred[:, :actual_h, :actual_w]
-                    
-                    # Create corresponding weight map for this window
-                    current_weight = gaussian_weight[:actual_h, :actual_w]
+        try:
+            with torch.no_grad():
+                for index, (window, keep) in enumerate(zip(plan.windows, plan.keeps)):
+                    check_cancelled(cancel)
+                    h_start, w_start, h_end, w_end = window
+                    keep_h_start, keep_w_start, keep_h_end, keep_w_end = keep
                     
-                    # Apply Gaussian weighting
-                    weighted_pred = window_pred * current_weight
+                    # Windows that are not run keep the fallback probability (zero by default);
+                    # their weight is already in the plan
+                    run = window_filter is None or window_filter(h_start, w_start, h_end, w_end)
+                    if run:
+                        window_batch = self.window_batch(image, h_start, w_start, h_end, w_end, device)
+                        run = self.screener is None or self.screener(model, window_batch)
+                        if not run:
+                            self.release(window_batch)
+                    if not run:
+                        skipped += 1
+                        if fallback is not None:
+                            prediction[:, keep_h_start:keep_h_end, keep_w_start:keep_w_end] += (
+                                fallback[:, keep_h_start:keep_h_end, keep_w_start:keep_w_end]
+                                * plan.keep_weight(window, keep)
+                            )
+                        windows_done([index])
+                        continue
                     
-                    # Add to full prediction with weights
-                    prediction[:, h_start:h_end, w_start:w_end] += weighted_pred
-                    weight_map[h_start:h_end, w_start:w_end] += current_weight
-        
+                    # Every window of a plan has the same shape, so they stack into one batch
+                    pending.append((plan, prediction, window, keep, window_batch))
+                    pending_indices.append(index)
+                    if len(pending) >= self.batch_size:
+                        self._run_batch(model, pending)
+                        windows_done(pending_indices)
+                        pending, pending_indices = [], []
+                if pending:
+                    self._run_batch(model, pending)
+                    windows_done(pending_indices)
+        except PredictionCancelled:
+            for _, _, _, _, window_batch in pending:
+                self.release(window_batch)
+            self.release(prediction)
+            raise
+
         # Normalize by weights to handle overlaps
-        weight_map[weight_map == 0] = 1  # Avoid division by zero
-        prediction = prediction / weight_map.unsqueeze(0)
+        prediction *= plan.inv_weight_map
+        
+        if info is not None:
+            info['windows'] = len(plan)
+            info['skipped_windows'] = skipped
+            info['skip_rate'] = skipped / len(plan) if len(plan) else 0.0
+            info['tiling'] = self.tiling
+            if self.tiling == 'overlap_tile':
+                info['context_margin'] = self.context_margin
+            if self.screener is not None:
+                info['screen_method'] = self.screener.method
+                info['screen_threshold'] = self.screener.threshold
         
         return prediction.squeeze(0)
     
+    def predict_many(self, model, images, infos=None, batch_size=None, cancel=None):
+        """
+        Predicts several images, pooling their windows into shared model batches
+
+        Full-size windows are stacked together regardless of which image they come
+        from, so the last windows of one image fill a batch with the first of the
+        next. Windows of images smaller than a window rarely share a shape; they run
+        once their image is tiled. An image is yielded as soon as all of its windows
+        have been run.
+
+        Args:
+            model: Trained model
+            images: Iterable of input images, tensors (C, H, W) or numpy arrays (H, W, C)
+            infos: Optional list of dicts, one per image, filled with per-image statistics
+            batch_size: Windows stacked into one model pass (default: self.batch_size)
+            cancel: Optional callable polled before every window, see __call__
+
+        Yields:
+            (index, prediction): Image index and its full resolution prediction tensor
+        """
+        device = next(model.parameters()).device
+        batch_size = batch_size or self.batch_size
+        pending = OrderedDict()  # window batch shape -> [(state, entry)] waiting for a model pass
+        padded_size = self.window_size + (-self.window_size % 32)
+        full_size = (padded_size, padded_size)
+
+        def run(group):
+            self._run_batch(model, [entry for _, entry in group])
+            done = []
+            for state, _ in group:
+                state['left'] -= 1
+                if state['left'] == 0:
+                    done.append(state)
+            return done
+
+        def finish(state):
+            plan, prediction = state['plan'], state['prediction']
+            prediction *= plan.inv_weight_map
+            if infos is not None:
+                info = infos[state['index']]
+                info['windows'] = len(plan)
+                info['skipped_windows'] = state['skipped']
+                info['skip_rate'] = state['skipped'] / len(plan) if len(plan) else 0.0
+                info['tiling'] = self.tiling
+                info['seconds'] = time.perf_counter() - state['start']
+            return state['index'], prediction.squeeze(0)
+
+        active = {}  # index -> state of images whose prediction is not finished yet
+        model.eval()
+        try:
+            with torch.no_grad():
+                for index, image in enumerate(images):
+                    check_cancelled(cancel)
+                    image = self.prepare(image)
+                    H, W = self.image_size(image)
+                    plan = self.get_plan(H, W, device)
+                    state = {
+                        'index': index,
+                        'plan': plan,
+                        'prediction': self.acquire((1, H, W), device, zero=True),
+                        'left': len(plan),
+                        'skipped': 0,
+                        'start': time.perf_counter(),
+                    }
+                    active[index] = state
+                    done = []
+                    for window, keep in zip(plan.windows, plan.keeps):
+                        check_cancelled(cancel)
+                        window_batch = self.window_batch(image, *window, device)
+                        if self.screener is not None and not self.screener(model, window_batch):
+                            self.release(window_batch)
+                            state['left'] -= 1
+                            state['skipped'] += 1
+                            continue
+                        shape = tuple(window_batch.shape)
+                        group = pending.setdefault(shape, [])
+                        group.append((state, (plan, state['prediction'], window, keep, window_batch)))
+                        if len(group) >= batch_size:
+                            done += run(pending.pop(shape))
+                    if state['left'] == 0 and all(other is not state for other in done):
+                        done.append(state)  # Its remaining windows were all skipped
+                    # Only full windows are likely to meet their shape again; windows of images
+                    # smaller than a window run now so those images finish without waiting for the end
+                    for shape in [shape for shape in pending if shape[2:] != full_size]:
+                        done += run(pending.pop(shape))
+                    for state in done:
+                        del active[state['index']]
+                        yield finish(state)
+                while pending:
+                    check_cancelled(cancel)
+                    _, group = pending.popitem(last=False)
+                    for state in run(group):
+                        del active[state['index']]
+                        yield finish(state)
+        except (PredictionCancelled, MemoryBudgetExceeded, GeneratorExit):
+            # Cancelled, an image over budget, or the consumer stopped iterating: return every buffer still held
+            for group in pending.values():
+                for _, entry in group:
+                    self.release(entry[-1])
+            for state in active.values():
+                self.release(state['prediction'])
+            raise
+
+    def predict_region(self, model, image, region, window_cache=None, cache_key=(), info=None, cancel=None):
+        """
+        Predicts one region of an image with the windows of the whole image's plan
+
+        Only windows whose kept region overlaps the region are used. Their outputs
+        are looked up in window_cache first; missing ones are run through the model
+        in batches and cached.
+
+        Args:
+            model: Trained model
+            image: Whole input image tensor (C, H, W) or numpy array (H, W, C)
+            region: (h_start, w_start, h_end, w_end) inside the image
+            window_cache: Optional WindowCache shared between calls
+            cache_key: Tuple identifying the image and model; the window is appended
+            info: Optional dict filled with per-call statistics
+            cancel: Optional callable polled before every window, see __call__
+
+        Returns:
+            prediction: (h, w) prediction of the region
+        """
+        device = next(model.parameters()).device
+        image = self.prepare(image)
+        H, W = self.image_size(image)
+        r_h_start, r_w_start, r_h_end, r_w_end = region
+        if not (0 <= r_h_start < r_h_end <= H and 0 <= r_w_start < r_w_end <= W):
+            raise ValueError(f"Region {region} is outside the {H}x{W} image")
+
+        plan = self.get_plan(H, W, device)
+        prediction = self.acquire((1, r_h_end - r_h_start, r_w_end - r_w_start), device, zero=True)
+
+        def blend(window, keep, kept):
+            # kept covers the window's kept region; add the part inside the region
+            if kept is None:
+                return
+            h_start, w_start = max(keep[0], r_h_start), max(keep[1], r_w_start)
+            h_end, w_end = min(keep[2], r_h_end), min(keep[3], r_w_end)
+            inside = (slice(h_start - keep[0], h_end - keep[0]), slice(w_start - keep[1], w_end - keep[1]))
+            prediction[:, h_start - r_h_start:h_end - r_h_start, w_start - r_w_start:w_end - r_w_start].addcmul_(
+                kept[(slice(None),) + inside].to(device, torch.float32), plan.keep_weight(window, keep)[inside],
+            )
+
+        needed = [(window, keep) for window, keep in zip(plan.windows, plan.keeps)
+                  if keep[0] < r_h_end and r_h_start < keep[2] and keep[1] < r_w_end and r_w_start < keep[3]]
+        missing = []
+        try:
+            with torch.no_grad():
+                for window, keep in needed:
+                    kept = WindowCache.MISSING if window_cache is None else window_cache.get(cache_key + (window,))
+                    if kept is WindowCache.MISSING:
+                        missing.append((window, keep))
+                    else:
+                        blend(window, keep, kept)
+
+                for start in range(0, len(missing), self.batch_size):
+                    check_cancelled(cancel)
+                    chunk = []
+                    for window, keep in missing[start:start + self.batch_size]:
+                        window_batch = self.window_batch(image, *window, device)
+                        if self.screener is not None and not self.screener(model, window_batch):
+                            self.release(window_batch)
+                            if window_cache is not None:
+                                window_cache.put(cache_key + (window,), None)
+                            continue
+                        chunk.append((window, keep, window_batch))
+                    if not chunk:
+                        continue
+                    windows = [window_batch for _, _, window_batch in chunk]
+                    batch = windows[0] if len(windows) == 1 else torch.cat(windows)
+                    window_preds = self._predict_window(model, batch)
+                    for window_batch in windows:
+                        self.release(window_batch)
+                    for (window, keep, _), window_pred in zip(chunk, window_preds):
+                        kept = window_pred[:, keep[0] - window[0]:keep[2] - window[0],
+                                           keep[1] - window[1]:keep[3] - window[1]]
+                        if window_cache is not None:
+                            window_cache.put(cache_key + (window,), kept)
+                        blend(window, keep, kept)
+        except PredictionCancelled:
+            self.release(prediction)
+            raise
+
+        prediction *= plan.inv_weight_map[r_h_start:r_h_end, r_w_start:r_w_end]
+        if info is not None:
+            info['windows'] = len(needed)
+            info['cached_windows'] = len(needed) - len(missing)
+            info['computed_windows'] = len(missing)
+            info['tiling'] = self.tiling
+        return prediction.squeeze(0)
+
+    def _run_batch(self, model, pending):
+        """
+        Runs a batch of equally shaped windows through the model and blends their
+        kept regions into the prediction each window belongs to
+
+        Args:
+            model: Trained model
+            pending: List of (plan, prediction, window, keep, window_batch)
+        """
+        windows = [window_batch for _, _, _, _, window_batch in pending]
+        if len(windows) == 1:
+            batch = windows[0]
+        else:
+            batch = torch.cat(windows, out=self.acquire((len(windows),) + tuple(windows[0].shape[1:]),
+                                                        windows[0].device))
+        
+        # Get prediction for windows - this will be handled by the caller
+        window_preds = self._predict_window(model, batch)
+        for window_batch in windows:
+            self.release(window_batch)
+        if len(windows) > 1:
+            self.release(batch)
+        
+        for (plan, prediction, window, keep, _), window_pred in zip(pending, window_preds):
+            h_start, w_start = window[0], window[1]
+            keep_h_start, keep_w_start, keep_h_end, keep_w_end = keep
+            
+            # Weight the kept region and add it to the full prediction
+            window_pred = window_pred[:, keep_h_start - h_start:keep_h_end - h_start,
+                                      keep_w_start - w_start:keep_w_end - w_start]
+            prediction[:, keep_h_start:keep_h_end, keep_w_start:keep_w_end].addcmul_(
+                window_pred, plan.keep_weight(window, keep)
+            )
+    
     def _predict_window(self, model, window_batch):
         """
         Predict on a single window - to be overridden or configured based on model type
@@ -207,13 +2055,68 @@ class SlidingWindowCrop:
         """
         self._predict_window = predictor_func
 
+def probe_context_margin(model, window_size, tolerance=0.01, image=None):
+    """
+    Finds the smallest overlap-tile context margin whose output matches whole-image inference
+
+    Args:
+        model: Trained model
+        window_size: Size of sliding window the margin is probed for
+        tolerance: Maximum absolute probability difference allowed (default 0.01)
+        image: Optional probe image tensor (C, H, W) or numpy array (H, W, C); a seeded
+            random image twice the window size is used when omitted
+
+    Returns:
+        margin: Smallest passing margin (multiple of 32), or the largest candidate if none passes
+    """
+    device = next(model.parameters()).device
+    if image is None:
+        generator = torch.Generator().manual_seed(0)
+        image = torch.rand((3, 2 * window_size, 2 * window_size), generator=generator)
+
+    cropper = SlidingWindowCrop(window_size=window_size, tiling='overlap_tile')
+    image = cropper.prepare(image)
+    H, W = cropper.image_size(image)
+    candidates = list(range(0, window_size // 2, 32))
+
+    model.eval()
+    with torch.no_grad():
+        whole = cropper.window_batch(image, 0, 0, H, W, device)
+        reference = cropper._predict_window(model, whole)[0, 0, :H, :W]
+
+        # Error shrinks as the margin grows, so binary search the candidates
+        best = candidates[-1]
+        low, high = 0, len(candidates) - 1
+        while low <= high:
+            mid = (low + high) // 2
+            cropper.context_margin = candidates[mid]
+            error = (cropper(model, image) - reference).abs().max().item()
+            if error <= tolerance:
+                best = candidates[mid]
+                high = mid - 1
+            else:
+                low = mid + 1
+    return best
+
+
 if __name__ == "__main__":
-    # Test Functionality
-    import cv2
-    image_path = '137.jpg'
-    predictor = Predictor(model_path='IW_crack/hnet.pth', model_settings_path='model_settings.yaml')
-    image = cv2.imread(image_path)
-    output = predictor(image)
-    import matplotlib.pyplot as plt
-    plt.imshow(output, cmap='gray')
-    plt.show()
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description="Run the configured model on one image")
+    parser.add_argument('image', type=str, help="Path to the input image")
+    parser.add_argument('--settings', default='model_settings.yaml', type=str,
+                        help="Path to the model settings YAML file")
+    parser.add_argument('--check_precision', default=None, choices=['fp32', 'bf16'],
+                        help="Compare this precision against fp32 instead of showing the prediction")
+    parser.add_argument('--check_memory_format', default='contiguous', choices=['contiguous', 'channels_last'],
+                        help="Memory format used together with --check_precision")
+    args = parser.parse_args()
+
+    predictor = Predictor(model_settings_path=args.settings)
+    image = cv2.imread(args.image)
+    if args.check_precision:
+        print(predictor.check_execution_mode(image, args.check_precision, args.check_memory_format))
+    else:
+        output = predictor(image)
+        import matplotlib.pyplot as plt
+        plt.imshow(output, cmap='gray')
+        plt.show()
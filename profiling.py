@@ -0,0 +1,222 @@
+"""On-demand profiling of live prediction requests.
+
+``profiler.arm(requests=N, seconds=T)`` starts a capture. Until N requests
+have been profiled or T seconds have passed, whichever comes first:
+
+* each request wrapped in ``profiler.request()`` runs under torch.profiler and
+  leaves a Chrome trace (open in chrome://tracing or Perfetto) and a table of
+  the most expensive operators; concurrent requests are profiled one at a time
+* a background thread samples the Python stacks of every thread and writes
+  them as folded stacks (flamegraph.pl or speedscope input) when the capture ends
+
+Every capture ends after ``max_seconds`` at the latest, also when it waits
+for requests, and ``profiler.disarm()`` ends it early. Captures are written to
+``profiles/<capture id>/``. When no capture is armed, ``profiler.request()``
+only checks one attribute.
+
+Arming is per process: under gunicorn only the worker that handled the arm
+call profiles, and only requests that worker serves count towards N.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+
+class Profiler:
+    """Arms and records profiling captures.
+
+    :param root: Directory the captures are written to
+    :type root: str
+    :param max_captures: Captures kept on disk; older ones are deleted
+    :type max_captures: int
+    :param max_seconds: Longest a capture may stay armed
+    :type max_seconds: float
+    """
+
+    def __init__(self, root: str = 'profiles', max_captures: int = 20, max_seconds: float = 300.0):
+        self.root = root
+        self.max_captures = max_captures
+        self.max_seconds = max_seconds
+        self.armed = False
+        self._lock = threading.Lock()
+        self._torch_lock = threading.Lock()  # torch.profiler is process-wide; one request at a time
+        self._capture = None
+
+    def arm(self, requests: int = None, seconds: float = None, interval_ms: float = 5.0) -> dict:
+        """Starts a capture of the next requests or the next seconds.
+
+        :param requests: Requests to profile, None for no request limit
+        :type requests: int
+        :param seconds: Capture duration, at most ``max_seconds``, which also
+            applies when only a request count is given
+        :type seconds: float
+        :param interval_ms: Stack sampling interval
+        :type interval_ms: float
+        :raises ValueError: If no limit is given or a capture is already armed
+        :return: Description of the armed capture
+        :rtype: dict
+        """
+        if requests is None and seconds is None:
+            raise ValueError("Give a request count, a duration or both")
+        seconds = self.max_seconds if seconds is None else min(seconds, self.max_seconds)
+        with self._lock:
+            if self.armed:
+                raise ValueError(f"Capture {self._capture['id']} is already armed")
+            capture_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+            path = os.path.join(self.root, capture_id)
+            os.makedirs(path, exist_ok=True)
+            self._capture = {
+                'id': capture_id,
+                'path': path,
+                'requests_left': requests,
+                'deadline': time.monotonic() + seconds,
+                'profiled': [],
+                'stacks': Counter(),
+                'stop': threading.Event(),
+            }
+            sampler = threading.Thread(target=self._sample, args=(self._capture, interval_ms / 1000.0), daemon=True)
+            self._capture['sampler'] = sampler
+            self.armed = True
+        sampler.start()
+        self._prune()
+        return {'id': capture_id, 'requests': requests, 'seconds': seconds, 'interval_ms': interval_ms,
+                'pid': os.getpid()}
+
+    def disarm(self):
+        """Ends the armed capture early, writing what it has collected.
+
+        :return: Id of the ended capture, or None if none was armed
+        :rtype: str
+        """
+        with self._lock:
+            capture = self._capture if self.armed else None
+        if capture is None:
+            return None
+        self._finish(capture)
+        return capture['id']
+
+    @contextmanager
+    def request(self, name: str = 'request'):
+        """Profiles the enclosed request if a capture is armed and has requests left."""
+        if not self.armed:
+            yield
+            return
+        capture = self._claim()
+        if capture is None:
+            yield
+            return
+        import torch
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        prof = torch.profiler.profile(activities=activities, record_shapes=True)
+        start = time.perf_counter()
+        try:
+            with prof:
+                yield
+        finally:
+            try:
+                stem = os.path.join(capture['path'], f"{name}-{len(capture['profiled'])}")
+                prof.export_chrome_trace(stem + '.trace.json')
+                with open(stem + '.txt', 'w') as file:
+                    file.write(prof.key_averages().table(sort_by='self_cpu_time_total', row_limit=30))
+                capture['profiled'].append({'name': name, 'seconds': round(time.perf_counter() - start, 4)})
+            finally:
+                self._torch_lock.release()
+            if capture['requests_left'] is not None and len(capture['profiled']) >= capture['requests_left']:
+                self._finish(capture)
+
+    def _claim(self):
+        """Returns the armed capture if this request should be profiled, else None."""
+        with self._lock:
+            capture = self._capture
+            if not self.armed or capture is None:
+                return None
+            if time.monotonic() > capture['deadline']:
+                return None  # The sampler thread finishes the capture
+            claimed = len(capture['profiled']) + (1 if self._torch_lock.locked() else 0)
+            if capture['requests_left'] is not None and claimed >= capture['requests_left']:
+                return None
+            if not self._torch_lock.acquire(blocking=False):
+                return None
+            return capture
+
+    def _sample(self, capture: dict, interval: float):
+        """Samples every thread's Python stack until the capture ends."""
+        me = threading.get_ident()
+        names = {}
+        while not capture['stop'].wait(interval):
+            if time.monotonic() > capture['deadline']:
+                self._finish(capture)
+                break
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if ident not in names:
+                    thread = next((t for t in threading.enumerate() if t.ident == ident), None)
+                    names[ident] = thread.name if thread is not None else str(ident)
+                capture['stacks'][';'.join([names[ident]] + stack[::-1])] += 1
+
+    def _finish(self, capture: dict):
+        """Disarms the capture and writes its folded stacks and summary."""
+        with self._lock:
+            if capture is not self._capture or not self.armed:
+                return
+            self.armed = False
+        capture['stop'].set()
+        if threading.get_ident() != capture['sampler'].ident:
+            capture['sampler'].join()
+        with open(os.path.join(capture['path'], 'stacks.folded'), 'w') as file:
+            for stack, count in capture['stacks'].most_common():
+                file.write(f"{stack} {count}\n")
+        with open(os.path.join(capture['path'], 'summary.json'), 'w') as file:
+            json.dump({'id': capture['id'], 'requests': capture['profiled'],
+                       'samples': sum(capture['stacks'].values())}, file, indent=2)
+
+    def status(self) -> dict:
+        """Reports whether a capture is armed and lists the captures on disk.
+
+        :return: Status and captures, newest first
+        :rtype: dict
+        """
+        with self._lock:
+            armed = None
+            if self.armed:
+                armed = {'id': self._capture['id'], 'profiled': len(self._capture['profiled'])}
+        return {'pid': os.getpid(), 'armed': armed, 'captures': self.list_captures()}
+
+    def list_captures(self) -> list[dict]:
+        """Lists the captures on disk with their files, newest first.
+
+        :return: One dict per capture
+        :rtype: list[dict]
+        """
+        if not os.path.isdir(self.root):
+            return []
+        captures = []
+        for capture_id in sorted(os.listdir(self.root), reverse=True):
+            path = os.path.join(self.root, capture_id)
+            if os.path.isdir(path):
+                captures.append({
+                    'id': capture_id,
+                    'files': {name: os.path.getsize(os.path.join(path, name)) for name in sorted(os.listdir(path))},
+                })
+        return captures
+
+    def _prune(self):
+        captures = self.list_captures()
+        for capture in captures[self.max_captures:]:
+            shutil.rmtree(os.path.join(self.root, capture['id']), ignore_errors=True)
+
+
+profiler = Profiler()
@@ -356,6 +356,19 @@ export class Canvas {
         this.removeGray();
     }
 
+    drawMaskTile(x, y, width, height, maskBase64) {
+        // Paints one streamed prediction tile at its position on the mask
+        return new Promise((resolve) => {
+            const tile = new Image();
+            tile.onload = () => {
+                this.replaceMaskRegionWithImage(x, y, width, height, tile);
+                resolve(true);
+            };
+            tile.onerror = () => resolve(false);
+            tile.src = maskBase64;
+        });
+    }
+
 
 
     // ============================================================
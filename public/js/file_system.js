@@ -129,7 +129,9 @@ export class FileSystem {
             });
     }
     
-    async predictCropImage(cropImageBase64) {
+    async predictCropImage(cropImageBase64, crop = null) {
+        // When crop {x, y, width, height} locates the crop in the opened image, the server
+        // predicts it from the dataset file on a fixed grid and reuses cached windows
         // Remove data URL prefix if it exists
         const base64Data = cropImageBase64.includes('base64,') 
             ? cropImageBase64.split('base64,')[1]
@@ -139,13 +141,17 @@ export class FileSystem {
             // Display loading or progress indicator
             console.log("Sending image for prediction...");
             
+            const body = crop && this.image_name
+                ? { source: { dataset: this.dataset_name, filename: this.image_name, ...crop } }
+                : { image: base64Data };
+
             // Send the request using POST instead of GET to handle large images
             const response = await fetch('/predict', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
                 },
-                body: JSON.stringify({ image: base64Data })
+                body: JSON.stringify(body)
             });
             
             if (!response.ok) {
@@ -181,4 +187,84 @@ export class FileSystem {
             };
         }
     }
+
+    async predictCropImageStream(cropImageBase64, onTile) {
+        // Streams the prediction of a large image: onTile({x, y, width, height, maskBase64})
+        // is called for every finished region of the mask while the rest is computed
+        const base64Data = cropImageBase64.includes('base64,')
+            ? cropImageBase64.split('base64,')[1]
+            : cropImageBase64;
+
+        try {
+            const response = await fetch('/predict/stream', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({ image: base64Data })
+            });
+
+            if (!response.ok) {
+                console.error(`Streaming prediction request failed with status: ${response.status}`);
+                return {
+                    success: false,
+                    error: `Server returned error ${response.status}`
+                };
+            }
+
+            // Parse server-sent events from the response body as it arrives
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                let boundary;
+                while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                    const message = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+                    let event = 'message';
+                    let data = '';
+                    for (const line of message.split('\n')) {
+                        if (line.startsWith('event: ')) event = line.slice(7);
+                        else if (line.startsWith('data: ')) data += line.slice(6);
+                    }
+                    const payload = JSON.parse(data);
+                    if (event === 'tile') {
+                        onTile({
+                            x: payload.x,
+                            y: payload.y,
+                            width: payload.width,
+                            height: payload.height,
+                            maskBase64: payload.mask_base64
+                        });
+                    } else if (event === 'done') {
+                        console.log(`Prediction streamed, first tile after ${payload.time_to_first_tile}s`);
+                        return {
+                            success: true,
+                            info: payload.info,
+                            timeToFirstTile: payload.time_to_first_tile
+                        };
+                    } else if (event === 'error') {
+                        console.error("Prediction failed:", payload.message);
+                        return {
+                            success: false,
+                            error: payload.message
+                        };
+                    }
+                }
+            }
+            return {
+                success: false,
+                error: "Prediction stream ended unexpectedly"
+            };
+        } catch (error) {
+            console.error("Error during streaming prediction request:", error);
+            return {
+                success: false,
+                error: error.message || "Unknown error occurred during prediction"
+            };
+        }
+    }
 }
\ No newline at end of file
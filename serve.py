@@ -0,0 +1,125 @@
+"""Production entry point for the masker app.
+
+Runs app.py under gunicorn instead of Flask's single-process debug server:
+
+* The model is loaded once in the master process (``preload_app``). Workers
+  are forked afterwards and share its weights copy-on-write; memory-mapped
+  checkpoints (see convert_checkpoint.py) additionally stay shared in the
+  page cache.
+* Each worker gets ``cores // workers`` torch intra-op threads, a single
+  inter-op thread and (unless max_concurrent_forwards is configured) one
+  forward pass at a time, so N workers together use the machine's cores
+  once instead of N times over.
+* Workers use the threaded (gthread) worker class, which supports HTTP
+  keep-alive.
+
+Scaling out on one host: raise --workers until the cores are used; every
+worker serves requests in parallel with its own slice of cores. Use
+--max_requests to recycle workers periodically.
+
+Reloading:
+    kill -HUP <master pid>    re-forks workers gracefully; in-flight requests
+                              finish on the old workers. The preloaded model
+                              is reused, so this picks up gunicorn settings only.
+    kill -USR2 <master pid>   starts a new master that re-imports the app and
+                              reloads the model; then send TERM to the old master.
+    With hot_reload enabled in model_settings.yaml, every worker also reloads the
+    model in place when the settings file or checkpoint changes (see /version).
+
+Usage:
+    python serve.py --workers 4 --bind 0.0.0.0:8000 --root_data_path ./datasets
+
+Requires gunicorn (pip install gunicorn).
+"""
+import os
+import argparse
+
+
+def build_options(args) -> dict:
+    """Translates command line arguments into gunicorn settings.
+
+    :return: gunicorn setting names mapped to values
+    :rtype: dict
+    """
+    return {
+        'bind': args.bind,
+        'workers': args.workers,
+        'worker_class': 'gthread',
+        'threads': args.threads,
+        'keepalive': args.keepalive,
+        'timeout': args.timeout,
+        'graceful_timeout': args.graceful_timeout,
+        'max_requests': args.max_requests,
+        'max_requests_jitter': args.max_requests // 10,
+        'preload_app': True,
+        'accesslog': '-',
+    }
+
+
+def main():
+    cores = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bind', default='0.0.0.0:8000', type=str,
+                        help="Address to listen on")
+    parser.add_argument('--workers', default=max(1, cores // 4), type=int,
+                        help="Number of forked worker processes (default: cores / 4)")
+    parser.add_argument('--threads', default=2, type=int,
+                        help="Request threads per worker")
+    parser.add_argument('--intra_op_threads', default=None, type=int,
+                        help="Torch intra-op threads per worker (default: cores / workers)")
+    parser.add_argument('--keepalive', default=5, type=int,
+                        help="Seconds to keep idle HTTP connections open")
+    parser.add_argument('--timeout', default=120, type=int,
+                        help="Seconds before a silent worker is killed and restarted")
+    parser.add_argument('--graceful_timeout', default=60, type=int,
+                        help="Seconds workers get to finish in-flight requests on reload or shutdown")
+    parser.add_argument('--max_requests', default=0, type=int,
+                        help="Recycle a worker after this many requests (0 disables)")
+    # Remaining arguments (e.g. --root_data_path) are read by app.py itself
+    args, _ = parser.parse_known_args()
+
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise SystemExit("serve.py requires gunicorn (pip install gunicorn)")
+
+    intra_op_threads = args.intra_op_threads or max(1, cores // args.workers)
+
+    def post_fork(server, worker):
+        # Re-derive the runtime for this worker's share of the cores
+        from app import predictor
+        overrides = {'intra_op_threads': intra_op_threads, 'inter_op_threads': 1}
+        if not predictor.model_settings.get('max_concurrent_forwards'):
+            # The worker's thread share fits one forward; more would oversubscribe
+            overrides['max_concurrent_forwards'] = 1
+        predictor.model_settings.update(overrides)
+        predictor.settings_overrides.update(overrides)  # Also for hot-reloaded models
+        predictor.configure_runtime()
+        if predictor.model_settings.get('hot_reload', False):
+            predictor.start_watching()  # The master's watcher thread does not survive the fork
+        server.log.info(f"Worker {worker.pid}: {predictor.runtime}")
+
+    class MaskerApplication(BaseApplication):
+        def __init__(self, options: dict):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            # With preload_app this runs once in the master, loading the model before forking
+            from app import app, predictor
+            predictor.stop_watching()  # Workers watch for reloads themselves
+            return app
+
+    options = build_options(args)
+    options['post_fork'] = post_fork
+    print(f"Serving on {args.bind} with {args.workers} workers x {args.threads} threads, "
+          f"{intra_op_threads} intra-op threads per worker")
+    MaskerApplication(options).run()
+
+
+if __name__ == "__main__":
+    main()